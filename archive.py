@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module keeps the values of the heat pump with full (one minute)
+    resolution for ever, as the round robin database consolidates them after
+    a day. Every month has a directory with one file per data source, which
+    holds a float64 for every minute of the month (NaN if there is no value).
+    So the position of a value is calculated from its time and a range of a
+    source is a slice of a memory mapped file, nothing is copied.
+
+    usage: archive.py archiveDirectory source [start [end]]
+"""
+
+import os
+import sys
+import time
+import calendar
+
+import numpy
+
+step = 60
+# the values are stored little endian, so the files can be copied to other machines
+dtype = numpy.dtype("<f8")
+
+def _monthStart(timestamp):
+    """ the months are in UTC, so there is no daylight saving time """
+    t = time.gmtime(timestamp)
+    return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+
+def _nextMonthStart(monthStart):
+    t = time.gmtime(monthStart)
+    if t.tm_mon == 12:
+        return calendar.timegm((t.tm_year + 1, 1, 1, 0, 0, 0))
+    return calendar.timegm((t.tm_year, t.tm_mon + 1, 1, 0, 0, 0))
+
+
+class ColumnArchive:
+    _directory = None
+    # (monthStart, source) -> memmap, only the written ones stay open
+    _segments = None
+
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._segments = {}
+
+    def _segmentFile(self, monthStart, source):
+        return os.path.join(self._directory, time.strftime("%Y-%m", time.gmtime(monthStart)), "%s.f8" % source)
+
+    def _createSegment(self, filename, length):
+        """ the file is filled with NaN and renamed, so there is never a half created one """
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmpFile = filename + ".tmp"
+        m = numpy.memmap(tmpFile, dtype=dtype, mode="w+", shape=(length,))
+        m[:] = numpy.nan
+        m.flush()
+        del m
+        os.rename(tmpFile, filename)
+
+    def _getSegment(self, monthStart, source, create=False):
+        """ returns the memmap of the month or None if it does not exist """
+        key = (monthStart, source)
+        if key in self._segments:
+            return self._segments[key]
+        filename = self._segmentFile(monthStart, source)
+        if not os.path.isfile(filename):
+            if not create:
+                return None
+            self._createSegment(filename, (_nextMonthStart(monthStart) - monthStart) // step)
+        if create:
+            # we write into this month, so we keep it open
+            self._segments[key] = numpy.memmap(filename, dtype=dtype, mode="r+")
+            return self._segments[key]
+        return numpy.memmap(filename, dtype=dtype, mode="r")
+
+    def add(self, aDict, timestamp=None):
+        """ writes all numeric values, strings like times and dates are skipped """
+        if timestamp is None:
+            timestamp = time.time()
+        timestamp = int(timestamp)
+        monthStart = _monthStart(timestamp)
+        # a new month started, the old ones are not needed anymore
+        for key in self._segments.keys():
+            if key[0] != monthStart:
+                self._segments.pop(key).flush()
+        index = (timestamp - monthStart) // step
+        for source, value in aDict.items():
+            if isinstance(value, (int, long, float)):
+                self._getSegment(monthStart, source, True)[index] = value
+
+    def addBatch(self, samples):
+        """ adds a list of (timestamp, dict) """
+        for timestamp, aDict in samples:
+            self.add(aDict, timestamp)
+        self.flush()
+
+    def flush(self):
+        """ writes the changed pages to disk """
+        for m in self._segments.values():
+            m.flush()
+
+    def close(self):
+        self.flush()
+        self._segments = {}
+
+    def getSources(self, timestamp=None):
+        """ returns the sources of the month """
+        if timestamp is None:
+            timestamp = time.time()
+        directory = os.path.dirname(self._segmentFile(_monthStart(timestamp), "x"))
+        if not os.path.isdir(directory):
+            return []
+        return sorted([os.path.splitext(f)[0] for f in os.listdir(directory) if f.endswith(".f8")])
+
+    def slices(self, source, start, end):
+        """ yields (timestamp of the first value, array) for every month between
+            start and end, each array is a view into the memory mapped file. Months
+            without the source yield NaN arrays.
+        """
+        start = int(start) // step * step
+        end = int(end) // step * step
+        monthStart = _monthStart(start)
+        while monthStart <= end:
+            nextMonthStart = _nextMonthStart(monthStart)
+            first = max(start, monthStart)
+            last = min(end, nextMonthStart - step)
+            m = self._getSegment(monthStart, source)
+            if m is None:
+                view = numpy.empty((last - first) // step + 1, dtype=dtype)
+                view[:] = numpy.nan
+            else:
+                view = m[(first - monthStart) // step:(last - monthStart) // step + 1]
+            yield first, view
+            monthStart = nextMonthStart
+
+    def fetch(self, source, start, end=None):
+        """ returns (timestamp of the first value, array with a value per minute),
+            only a range over more than one month is copied
+        """
+        if end is None:
+            end = time.time()
+        result = list(self.slices(source, start, end))
+        if len(result) == 1:
+            return result[0]
+        return result[0][0], numpy.concatenate([view for first, view in result])
+
+
+# Main program: prints the values of a source
+def main():
+    if len(sys.argv) < 3:
+        print __doc__
+        sys.exit(2)
+    end = time.time()
+    start = end - 3600
+    if len(sys.argv) > 3:
+        start = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        end = float(sys.argv[4])
+    first, values = ColumnArchive(sys.argv[1]).fetch(sys.argv[2], start, end)
+    for i, value in enumerate(values):
+        print "%s %s" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(first + i * step)), value)
+
+if __name__ == '__main__':
+    main()
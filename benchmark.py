@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module measures how long the hot paths of a monitoring cycle take:
+    checksum, frame receiving, decoding of every shipped protocol version,
+    storage, rendering and the json file. The end to end benchmarks poll the
+    heat pump simulator, once only and once with the work the monitor does
+    with the values of a poll (storage, json file and rendering). The results
+    are written to a json file, so they can be compared between releases.
+
+    usage: benchmark.py [options]
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import timeit
+import optparse
+
+import protocol
+import protocolVersions
+import simulator
+import json
+
+# how often a benchmark is repeated, the best run counts
+repeat = 5
+
+class FakeSerial:
+    """ returns a prepared response frame like a serial line would do """
+    _data = None
+    _position = None
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def inWaiting(self):
+        return len(self._data) - self._position
+
+    def read(self, size=1):
+        s = self._data[self._position:self._position + size]
+        self._position += len(s)
+        return s
+
+
+class Benchmark:
+    _results = None
+    _protocolVersionsDirectory = None
+    _tempDirectory = None
+
+    def __init__(self, protocolVersionsDirectory="protocolVersions/"):
+        self._results = []
+        self._protocolVersionsDirectory = protocolVersionsDirectory
+        self._random = random.Random(42)
+
+    def measure(self, name, function, number):
+        """ runs the function number times per repeat and keeps the best time per call """
+        times = timeit.Timer(function).repeat(repeat, number)
+        best = min(times) / number
+        mean = sum(times) / (repeat * number)
+        self._results.append((name, number, best, mean))
+        print "%-60s %12.3f us %12.3f us" % (name, best * 1e6, mean * 1e6)
+        sys.stdout.flush()
+
+    def skip(self, name, reason):
+        print "%-60s skipped (%s)" % (name, reason)
+        sys.stdout.flush()
+
+    def run(self, cycles=True):
+        self._tempDirectory = tempfile.mkdtemp(prefix="heatpumpBenchmark")
+        try:
+            self.benchmarkChecksum()
+            self.benchmarkReceiver()
+            self.benchmarkDecoding()
+            self.benchmarkJson()
+            self.benchmarkStorage()
+            self.benchmarkRender()
+            if cycles:
+                self.benchmarkCycles()
+        finally:
+            shutil.rmtree(self._tempDirectory)
+
+    def write(self, filename):
+        """ writes the results as json file """
+        f = open(filename, "w")
+        f.write('{"time": %d, "python": "%s", "results": [\n' % (time.time(), sys.version.split()[0]))
+        lines = []
+        for name, number, best, mean in self._results:
+            lines.append('{"name": "%s", "number": %d, "best": %.9f, "mean": %.9f}' % (name, number, best, mean))
+        f.write(",\n".join(lines))
+        f.write('\n]}\n')
+        f.close()
+
+    ## ###############################  the benchmarks  ################################################
+
+    def _randomString(self, length):
+        return "".join([chr(self._random.randint(0, 255)) for i in xrange(length)])
+
+    def _values(self):
+        """ a dict like the one returned by Protocol.query """
+        config = protocolVersions.ProtocolVersions(self._protocolVersionsDirectory).getConfig("4.38")
+        result = {}
+        for query in config["queries"]:
+            result.update(query["decodePlan"].decode(self._randomString(query["responseLength"])))
+        return result
+
+    def benchmarkChecksum(self):
+        s = protocol.addChecksum(self._randomString(55))
+        self.measure("protocol._calcChecksum (55 bytes)", lambda: protocol._calcChecksum(s), 10000)
+        self.measure("protocol.verifyChecksum (56 bytes)", lambda: protocol.verifyChecksum(s), 10000)
+
+    def benchmarkReceiver(self):
+        # make sure there is something to escape in the frame
+        payload = self._randomString(53) + protocol.ESCAPE * 4
+        frame = protocol.BEGIN + payload.replace(protocol.ESCAPE, protocol.ESCAPE * 2) + protocol.ESCAPE + protocol.END
+        receiver = protocol.FrameReceiver()
+        self.measure("protocol.FrameReceiver.receive (57 bytes)", lambda: receiver.receive(FakeSerial(frame), "benchmark"), 5000)
+
+    def benchmarkDecoding(self):
+        for filename in sorted(os.listdir(self._protocolVersionsDirectory)):
+            if os.path.splitext(filename)[1].lower() != ".ini":
+                continue
+            versions, config = protocolVersions.parseConfig(os.path.join(self._protocolVersionsDirectory, filename))
+            for query in config["queries"]:
+                s = self._randomString(query["responseLength"])
+                self.measure("decode %s %s" % (versions[0], query["name"]), lambda: query["decodePlan"].decode(s), 5000)
+
+    def benchmarkJson(self):
+        values = self._values()
+        j = json.Json(os.path.join(self._tempDirectory, "actual_values.json"))
+        self.measure("json.Json.write", lambda: j.write(values), 1000)
+
+    def _backends(self):
+        """ returns the available rrd backends """
+        import rrdBackend
+        result = []
+        if rrdBackend.havePyrrd:
+            result.append(rrdBackend.PyrrdBackend())
+        if rrdBackend.rrdtool:
+            result.append(rrdBackend.RrdtoolBackend())
+        if not result:
+            raise ImportError, "neither pyrrd nor the rrdtool python bindings are installed"
+        return result
+
+    def benchmarkStorage(self):
+        try:
+            import storage
+            backends = self._backends()
+        except ImportError, e:
+            self.skip("storage.Storage.add", e)
+            return
+        values = self._values()
+        for backend in backends:
+            filename = os.path.join(self._tempDirectory, "benchmark_%s.rrd" % backend.name)
+            start = int(time.time()) - 10000
+            s = storage.Storage(filename, start=start, backend=backend)
+            # every value needs its own second
+            timestamps = iter(xrange(start + 1, start + 10000))
+            self.measure("storage.Storage.add (%s)" % backend.name, lambda: s.add(values, timestamps.next()), 10)
+
+    def benchmarkRender(self):
+        try:
+            import storage
+            import render
+            backends = self._backends()
+        except ImportError, e:
+            self.skip("render.Render.renderGraph", e)
+            return
+        currentTime = int(time.time())
+        for backend in backends:
+            filename = os.path.join(self._tempDirectory, "benchmark_%s.rrd" % backend.name)
+            if not os.path.isfile(filename):
+                storage.Storage(filename, backend=backend).add(self._values())
+            r = render.Render(filename, self._tempDirectory, backend)
+            for timeName in sorted(render.times):
+                for graphName in sorted(render.graphsDefinition):
+                    self.measure("render %s %s (%s)" % (graphName, timeName, backend.name),
+                                 lambda: r.renderGraph(graphName, timeName, currentTime), 1)
+            # the archives got no new row since the graphs were painted
+            r.render()
+            self.measure("render.Render.render up to date (%s)" % backend.name, r.render, 10)
+
+    def benchmarkCycles(self):
+        """ polls the simulator with the real line speed. Like in the monitor a poll
+            does only the due queries, so the ones with a long interval (e.g. the
+            fault memory) are only in the first one. Without a persistent connection
+            (the default) every poll opens the connection and waits a second after
+            closing it.
+        """
+        try:
+            import rrdBackend
+            backend = rrdBackend.getBackend()
+        except ImportError, e:
+            backend = None
+            self.skip("cycle (poll, storage, json, render)", e)
+        for filename in sorted(os.listdir(self._protocolVersionsDirectory)):
+            if os.path.splitext(filename)[1].lower() != ".ini":
+                continue
+            s = simulator.Simulator(os.path.join(self._protocolVersionsDirectory, filename), seed=42)
+            s.start()
+            try:
+                for persistentConnection, name, number in ((False, "new connection", 2), (True, "persistent connection", 10)):
+                    p = protocol.Protocol(s.getDevice(), self._protocolVersionsDirectory, persistentConnection=persistentConnection)
+                    self.measure("poll %s (%s)" % (s._version, name), p.query, number)
+                    p.close()
+                if backend:
+                    self._benchmarkCycle(s, backend)
+            finally:
+                s.stop()
+
+    def _benchmarkCycle(self, aSimulator, backend):
+        """ a poll and what Sinks.process does with its values, the storage gets
+            them directly instead of the writer thread and the graphs are painted
+            after every poll (renderInterval 1)
+        """
+        import storage
+        import render
+        directory = os.path.join(self._tempDirectory, "cycle_%s" % aSimulator._version)
+        os.mkdir(directory)
+        filename = os.path.join(directory, "cycle.rrd")
+        start = int(time.time())
+        p = protocol.Protocol(aSimulator.getDevice(), self._protocolVersionsDirectory)
+        s = storage.Storage(filename, start=start, backend=backend)
+        j = json.Json(os.path.join(directory, "actual_values.json"))
+        r = render.Render(filename, directory, backend)
+        # every poll adds a row to the one minute archive
+        timestamps = iter(xrange(start + storage.step, start + 1000000 * storage.step, storage.step))
+        def cycle():
+            values = p.query()
+            s.add(values, timestamps.next())
+            j.write(values)
+            r.render()
+        self.measure("cycle %s (poll, storage, json, render with %s)" % (aSimulator._version, backend.name), cycle, 2)
+        p.close()
+
+
+# Main program: parse command line and start processing
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-o", "--output", default="benchmark.json", help="file the results are written to")
+    parser.add_option("-d", "--protocol-versions", default="protocolVersions/", help="directory with the protocol version files")
+    parser.add_option("-n", "--no-cycles", action="store_true", help="skip the end to end benchmarks with the simulator")
+    options, args = parser.parse_args()
+
+    b = Benchmark(options.protocol_versions)
+    b.run(cycles=not options.no_cycles)
+    b.write(options.output)
+    print "Results written to %s" % options.output
+
+if __name__ == '__main__':
+    main()
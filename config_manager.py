@@ -51,8 +51,73 @@ class ConfigManager:
         return self._config.get("Global", "pidFile")
     
     # Storage
-    def getDatabaseFile(self):
-        return self._config.get("Storage", "databaseFile")
+    def getDatabaseFile(self, device=None):
+        """ each device has its own database file, if it is not configured
+            in the device section its name is added to the default one
+        """
+        if not device:
+            return self._config.get("Storage", "databaseFile")
+        if self._config.has_option("Protocol:%s" % device, "databaseFile"):
+            return self._config.get("Protocol:%s" % device, "databaseFile")
+        base, extension = os.path.splitext(self._config.get("Storage", "databaseFile"))
+        return "%s_%s%s" % (base, device, extension)
+    
+    def getStorageBackend(self):
+        """ pyrrd or rrdtool (the python bindings) """
+        if not self._config.has_option("Storage", "backend"):
+            return "pyrrd"
+        return self._config.get("Storage", "backend").strip()
+    
+    def getStorageBufferSize(self):
+        """ how many polls are written to the database with one update """
+        if not self._config.has_option("Storage", "bufferSize"):
+            return 1
+        return self._config.getint("Storage", "bufferSize")
+    
+    def getStorageFlushInterval(self):
+        """ buffered values are written at the latest after these seconds """
+        if not self._config.has_option("Storage", "flushInterval"):
+            return 0
+        return self._config.getint("Storage", "flushInterval")
+    
+    def getSqliteFile(self, device=None):
+        """ returns None if all values should not be stored in a SQLite database,
+            the device name is added like for the database file
+        """
+        if not self._config.has_option("Storage", "sqliteFile"):
+            return None
+        filename = self._config.get("Storage", "sqliteFile").strip()
+        if not filename or not device:
+            return filename or None
+        if self._config.has_option("Protocol:%s" % device, "sqliteFile"):
+            return self._config.get("Protocol:%s" % device, "sqliteFile")
+        base, extension = os.path.splitext(filename)
+        return "%s_%s%s" % (base, device, extension)
+    
+    def getArchiveDirectory(self, device=None):
+        """ returns None if the values should not be archived with full resolution,
+            each device archives into a sub directory with its name
+        """
+        if not self._config.has_option("Storage", "archiveDirectory"):
+            return None
+        directory = self._config.get("Storage", "archiveDirectory").strip()
+        if not directory:
+            return None
+        if device:
+            return os.path.join(directory, device)
+        return directory
+    
+    def getWriteAheadFile(self, device=None):
+        """ the values which are not written yet are kept next to the database """
+        return os.path.splitext(self.getDatabaseFile(device))[0] + ".wal"
+    
+    def getVersionCacheFile(self, device=None):
+        """ the detected heat pump version is stored next to the database """
+        return os.path.splitext(self.getDatabaseFile(device))[0] + ".version"
+    
+    def getProtocolVersionsCacheFile(self, device=None):
+        """ the parsed protocol version files are cached next to the database """
+        return os.path.splitext(self.getDatabaseFile(device))[0] + ".protocolVersions"
         
     # Mail
     def getSendMails(self):
@@ -100,22 +165,127 @@ class ConfigManager:
 
 
     # Protocol
-    def getSerialDevice(self):
-        return self._config.get("Protocol", "serialDevice")
+    def getDevices(self):
+        """ returns the names of the heat pumps configured in [Protocol:<name>] sections,
+            if there are none the [Protocol] section is the only device (named None)
+        """
+        result = []
+        for section in self._config.sections():
+            if section.startswith("Protocol:"):
+                result.append(section[len("Protocol:"):])
+        result.sort()
+        return result or [None]
+    
+    def _protocolSection(self, device, option):
+        """ a device section can overwrite every option of the [Protocol] section """
+        if device and self._config.has_option("Protocol:%s" % device, option):
+            return "Protocol:%s" % device
+        return "Protocol"
+    
+    def getSerialDevice(self, device=None):
+        return self._config.get(self._protocolSection(device, "serialDevice"), "serialDevice")
+    
+    def getNewStyleSerialCommunication(self, device=None):
+        return self._config.getboolean(self._protocolSection(device, "newStyleSerialCommunication"), "newStyleSerialCommunication")
+    
+    def getProtocolVersionsDirectory(self, device=None):
+        return self._config.get(self._protocolSection(device, "protocolVersionsDirectory"), "protocolVersionsDirectory")
     
-    def getNewStyleSerialCommunication(self):
-        return self._config.getboolean("Protocol", "newStyleSerialCommunication")
+    def getPollInterval(self):
+        if not self._config.has_option("Protocol", "pollInterval"):
+            return 60
+        return self._config.getint("Protocol", "pollInterval")
     
-    def getProtocolVersionsDirectory(self):
-        return self._config.get("Protocol", "protocolVersionsDirectory")
+    def getPersistentConnection(self, device=None):
+        section = self._protocolSection(device, "persistentConnection")
+        if not self._config.has_option(section, "persistentConnection"):
+            return False
+        return self._config.getboolean(section, "persistentConnection")
+        
+    # Capture
+    def getCaptureDirectory(self, device=None):
+        """ returns None if the frames should not be recorded, each device
+            records into a sub directory with its name
+        """
+        if not self._config.has_option("Capture", "captureDirectory"):
+            return None
+        directory = self._config.get("Capture", "captureDirectory").strip()
+        if not directory:
+            return None
+        if device:
+            return os.path.join(directory, device)
+        return directory
+    
+    def getCaptureSegmentSize(self):
+        """ the size of a segment file in MB """
+        if not self._config.has_option("Capture", "segmentSize"):
+            return 16
+        return self._config.getint("Capture", "segmentSize")
+    
+    def getCaptureMaxSegments(self):
+        if not self._config.has_option("Capture", "maxSegments"):
+            return 0
+        return self._config.getint("Capture", "maxSegments")
         
     # Render
-    def getRenderOutputPath(self):
-        return self._config.get("Render", "renderOutputPath")
+    def getRenderOutputPath(self, device=None):
+        """ the graphs of each device go into a sub directory with its name """
+        if not device:
+            return self._config.get("Render", "renderOutputPath")
+        if self._config.has_option("Protocol:%s" % device, "renderOutputPath"):
+            return self._config.get("Protocol:%s" % device, "renderOutputPath")
+        return os.path.join(self._config.get("Render", "renderOutputPath"), device)
     
     def getRenderInterval(self):
         return self._config.getint("Render", "renderInterval")
     
+    def getSeriesInterval(self):
+        """ minutes between the updates of the data series for the browser charts, 0 for none """
+        if not self._config.has_option("Render", "seriesInterval"):
+            return 0
+        return self._config.getint("Render", "seriesInterval")
+    
+    def getRenderWorkers(self):
+        """ 0 paints the graphs in the monitor process """
+        if not self._config.has_option("Render", "workers"):
+            return 0
+        return self._config.getint("Render", "workers")
+    
+    def getRenderNiceLevel(self):
+        if not self._config.has_option("Render", "niceLevel"):
+            return 0
+        return self._config.getint("Render", "niceLevel")
+    
+    def getRenderBudget(self):
+        """ seconds a render cycle may take, 0 for no limit """
+        if not self._config.has_option("Render", "budget"):
+            return 0
+        return self._config.getint("Render", "budget")
+    
+    # HttpServer
+    def getHttpPort(self):
+        """ 0 if the graphs should not be served """
+        if not self._config.has_option("HttpServer", "port"):
+            return 0
+        return self._config.getint("HttpServer", "port")
+    
+    def getHttpAddress(self):
+        if not self._config.has_option("HttpServer", "address"):
+            return ""
+        return self._config.get("HttpServer", "address").strip()
+    
+    def getHttpCacheSize(self):
+        """ the size of the picture cache of each device in MB """
+        if not self._config.has_option("HttpServer", "cacheSize"):
+            return 8
+        return self._config.getint("HttpServer", "cacheSize")
+    
+    def getHtmlDirectory(self):
+        """ returns None if only the graphs should be served """
+        if not self._config.has_option("HttpServer", "htmlDirectory"):
+            return None
+        return self._config.get("HttpServer", "htmlDirectory").strip() or None
+    
     # Copy
     def getCopyCommand(self):
         return self._config.get("Copy", "copyCommand")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module records every response frame of the heat pump into an append
+    only binary log, which is split into segment files. Each record has a fixed
+    header (timestamp, query name, request id, flags and length) followed by
+    the un-escaped response (checksum, response id and payload). The reader
+    memory maps a segment and walks over the headers, so it can find a time
+    without parsing the payloads.
+
+    usage: frameCapture.py captureDirectory [start [end]]
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import threading
+
+# the first bytes of every segment file
+segmentMagic = "HPMCAP01"
+# marker, flags, timestamp, request id, query name, length of the data
+recordHeader = struct.Struct("<2sBxdI16sH")
+recordMarker = "FR"
+
+# record flags
+flagInvalid = 1 # the frame did not pass the checks in protocol.py
+
+def _segmentName(timestamp):
+    """ the segments are named by the time of their first record """
+    return "capture_%012.3f.bin" % timestamp
+
+def _segmentTime(filename):
+    return float(filename[len("capture_"):-len(".bin")])
+
+def listSegments(directory):
+    """ returns the segment files sorted by their start time """
+    result = []
+    for filename in os.listdir(directory):
+        if filename.startswith("capture_") and filename.endswith(".bin"):
+            result.append((_segmentTime(filename), os.path.join(directory, filename)))
+    result.sort()
+    return result
+
+
+class FrameCapture:
+    _directory = None
+    _segmentSize = None
+    _maxSegments = None
+    _file = None
+    _lock = None
+
+    def __init__(self, directory, segmentSize=16*1024*1024, maxSegments=0):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._directory = directory
+        self._segmentSize = segmentSize
+        self._maxSegments = maxSegments
+        self._lock = threading.Lock()
+
+    def record(self, queryName, requestId, data, flags=0, timestamp=None):
+        """ appends a frame to the actual segment """
+        if timestamp is None:
+            timestamp = time.time()
+        s = recordHeader.pack(recordMarker, flags, timestamp, requestId & 0xFFFFFFFF, queryName[:16], len(data)) + data
+        self._lock.acquire()
+        try:
+            if not self._file or self._file.tell() + len(s) > self._segmentSize:
+                self._rotate(timestamp)
+            self._file.write(s)
+            # no fsync, we just want the data to be written if the program crashes
+            self._file.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._file:
+                self._file.close()
+                self._file = None
+        finally:
+            self._lock.release()
+
+    def _rotate(self, timestamp):
+        """ starts a new segment and removes the oldest ones if there are too many """
+        if self._file:
+            self._file.close()
+            # if the new one cannot be opened, the next frame tries it again
+            self._file = None
+        self._file = open(os.path.join(self._directory, _segmentName(timestamp)), "ab")
+        if self._file.tell() == 0:
+            self._file.write(segmentMagic)
+        if self._maxSegments:
+            for startTime, filename in listSegments(self._directory)[:-self._maxSegments]:
+                os.remove(filename)
+
+
+class FrameCaptureReader:
+    _directory = None
+
+    def __init__(self, directory):
+        self._directory = directory
+
+    def records(self, start=None, end=None):
+        """ yields (timestamp, queryName, requestId, flags, data) for the records
+            between start and end, ordered by time
+        """
+        segments = listSegments(self._directory)
+        for i, (startTime, filename) in enumerate(segments):
+            # skip the segments which end before the start
+            if start is not None and i + 1 < len(segments) and segments[i + 1][0] <= start:
+                continue
+            if end is not None and startTime > end:
+                break
+            for record in self._walk(filename, start, end):
+                yield record
+
+    def _walk(self, filename, start, end):
+        """ walks over the headers of a memory mapped segment """
+        f = open(filename, "rb")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(segmentMagic):
+                return
+            m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        try:
+            if m[:len(segmentMagic)] != segmentMagic:
+                raise IOError, "Error: %s is not a capture segment" % filename
+            position = len(segmentMagic)
+            while position + recordHeader.size <= size:
+                marker, flags, timestamp, requestId, queryName, length = recordHeader.unpack_from(m, position)
+                dataStart = position + recordHeader.size
+                # a crash while writing can leave a half written record at the end
+                if marker != recordMarker or dataStart + length > size:
+                    break
+                position = dataStart + length
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    break
+                yield timestamp, queryName.rstrip("\0"), requestId, flags, m[dataStart:position]
+        finally:
+            m.close()
+
+
+# Main program: dumps the captured frames
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(2)
+    start = end = None
+    if len(sys.argv) > 2:
+        start = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        end = float(sys.argv[3])
+    import protocol
+    for timestamp, queryName, requestId, flags, data in FrameCaptureReader(sys.argv[1]).records(start, end):
+        print "%s %s #%d%s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), queryName, requestId,
+                               flags & flagInvalid and " (invalid)" or "")
+        protocol.printHex(data)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module is a small web server which paints a graph when it is
+    requested instead of painting all of them every few minutes. The pictures
+    are cached by graph, range, size and the newest row of the archive they
+    show, so a picture is only painted again if it would look different. The
+    key is sent as ETag, so the browsers can ask if their copy is still the
+    actual one without getting the picture again.
+
+    The graphs are at the same paths as the painted files, e.g.
+    /graphs/humidity_day_small.png or /graphs/cellar/humidity_day_small.png
+    with more than one heat pump. Everything else is served from the html
+    directory and /graphs from the render output path.
+
+    /events (or /events/cellar, /events is the first heat pump if they
+    have names) is a stream of server-sent events with the
+    actual values of every poll. One thread writes the events to all browsers
+    with non-blocking sockets, each event is serialized once and the same
+    string is sent to every browser.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import socket
+import shutil
+import urllib
+import tempfile
+import threading
+import mimetypes
+import collections
+import BaseHTTPServer
+import SocketServer
+
+import render
+
+class GraphCache:
+    """ the painted pictures of one database, the least recently used ones are
+        removed if they need more than maxBytes. If flush is set it is called
+        (at most every flushInterval seconds) before the state of a picture is
+        read, so the values buffered by the storage writer are painted too.
+    """
+    _render = None
+    _maxBytes = None
+    _bytes = None
+    _cache = None
+    _lock = None
+    _flush = None
+    _flushInterval = None
+    _lastFlushTime = None
+    _flushLock = None
+
+    def __init__(self, aRender, maxBytes=8*1024*1024, flush=None, flushInterval=10):
+        self._render = aRender
+        self._maxBytes = maxBytes
+        self._bytes = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._flush = flush
+        self._flushInterval = flushInterval
+        self._lastFlushTime = 0
+        self._flushLock = threading.Lock()
+
+    def _flushBuffer(self):
+        if not self._flush:
+            return
+        self._flushLock.acquire()
+        try:
+            if time.time() - self._lastFlushTime >= self._flushInterval:
+                self._flush()
+                self._lastFlushTime = time.time()
+        finally:
+            self._flushLock.release()
+
+    def _getState(self, graphName, timeName, sizeName):
+        """ returns (end time, ETag) the picture has now """
+        self._flushBuffer()
+        endTime = self._render.getEndTime(timeName, int(time.time()))
+        return endTime, '"%s-%s-%s-%d-%d"' % (graphName, timeName, sizeName, endTime, self._render.hasMinMax())
+
+    def getETag(self, graphName, timeName, sizeName):
+        """ returns the ETag the picture has now, nothing is painted for it """
+        return self._getState(graphName, timeName, sizeName)[1]
+
+    def get(self, graphName, timeName, sizeName):
+        """ returns (ETag, png data), it is painted if it is not in the cache """
+        endTime, eTag = self._getState(graphName, timeName, sizeName)
+        # only one is painted at a time, the others wait and get it from the cache
+        self._lock.acquire()
+        try:
+            data = self._cache.pop(eTag, None)
+            if data is None:
+                data = self._paint(graphName, timeName, sizeName, endTime)
+                self._bytes += len(data)
+                while self._cache and self._bytes > self._maxBytes:
+                    self._bytes -= len(self._cache.popitem(last=False)[1])
+            # it is the newest one now
+            self._cache[eTag] = data
+        finally:
+            self._lock.release()
+        return eTag, data
+
+    def _paint(self, graphName, timeName, sizeName, endTime):
+        fd, filename = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        try:
+            self._render.renderTo(filename, graphName, timeName, sizeName, endTime)
+            f = open(filename, "rb")
+            try:
+                return f.read()
+            finally:
+                f.close()
+        finally:
+            os.remove(filename)
+
+
+class EventBroadcaster(threading.Thread):
+    """ sends the published events to the connected browsers. A browser which
+        does not read gets no more than maxPending bytes queued, then it is
+        disconnected and its EventSource connects again.
+    """
+    _maxPending = None
+    _keepAliveInterval = None
+    _lock = None
+    # socket -> [device name, list of queued event strings, bytes of the first one which are sent]
+    _clients = None
+    # device name -> the last event, a new browser gets it at once
+    _last = None
+    # the thread waits in select, a byte in this pipe wakes it up
+    _wakeUp = None
+    _running = None
+
+    def __init__(self, maxPending=64*1024, keepAliveInterval=30):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self._maxPending = maxPending
+        self._keepAliveInterval = keepAliveInterval
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._last = {}
+        self._wakeUp = os.pipe()
+        self._running = True
+
+    def publish(self, device, data):
+        """ sends data (one line) to every browser which listens to the device """
+        event = "data: %s\n\n" % data
+        self._lock.acquire()
+        try:
+            self._last[device] = event
+            for client in self._clients.values():
+                if client[0] == device:
+                    client[1].append(event)
+        finally:
+            self._lock.release()
+        self._wake()
+
+    def add(self, sock, device):
+        """ the thread owns the socket now, the http headers are sent already """
+        sock.setblocking(0)
+        self._lock.acquire()
+        try:
+            self._clients[sock] = [device, [event for event in [self._last.get(device)] if event], 0]
+        finally:
+            self._lock.release()
+        self._wake()
+
+    def owns(self, sock):
+        return sock in self._clients
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        self.join()
+        for sock in self._clients.keys():
+            self._remove(sock)
+        os.close(self._wakeUp[0])
+        os.close(self._wakeUp[1])
+
+    def _wake(self):
+        os.write(self._wakeUp[1], "x")
+
+    def _remove(self, sock):
+        self._lock.acquire()
+        try:
+            del self._clients[sock]
+        finally:
+            self._lock.release()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+
+    def run(self):
+        lastKeepAlive = time.time()
+        while self._running:
+            self._lock.acquire()
+            try:
+                readers = self._clients.keys()
+                writers = [sock for sock, client in self._clients.items() if client[1]]
+            finally:
+                self._lock.release()
+            readable, writable = select.select(readers + [self._wakeUp[0]], writers, [], self._keepAliveInterval)[:2]
+            if self._wakeUp[0] in readable:
+                os.read(self._wakeUp[0], 4096)
+                readable.remove(self._wakeUp[0])
+            # the browsers send nothing, so something to read means they closed the connection
+            for sock in readable:
+                try:
+                    if sock.recv(4096):
+                        continue
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                        continue
+                self._remove(sock)
+            for sock in writable:
+                if sock in self._clients:
+                    self._send(sock)
+            if time.time() - lastKeepAlive >= self._keepAliveInterval:
+                # a comment, so proxies keep the connection and dead ones are found
+                lastKeepAlive = time.time()
+                self._lock.acquire()
+                try:
+                    for client in self._clients.values():
+                        client[1].append(":\n\n")
+                finally:
+                    self._lock.release()
+
+    def _send(self, sock):
+        self._lock.acquire()
+        try:
+            device, events, sent = self._clients[sock]
+            if sum([len(event) for event in events]) - sent > self._maxPending:
+                tooSlow = True
+            else:
+                tooSlow = False
+                # join returns the event itself if there is only one, so it is not copied
+                data = "".join(events)
+        finally:
+            self._lock.release()
+        if tooSlow:
+            self._remove(sock)
+            return
+        try:
+            n = sock.send(buffer(data, sent))
+        except socket.error, e:
+            if e.args[0] not in (errno.EAGAIN, errno.EINTR):
+                self._remove(sock)
+            return
+        self._lock.acquire()
+        try:
+            # the events which are sent completely are removed
+            n += sent
+            while events and n >= len(events[0]):
+                n -= len(events.pop(0))
+            self._clients[sock][2] = n
+        finally:
+            self._lock.release()
+
+
+class GraphRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = "heatpumpMonitor"
+
+    def do_GET(self):
+        self._send(True)
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def _send(self, withBody):
+        path = urllib.unquote(self.path.split("?", 1)[0])
+        parts = [part for part in path.split("/") if part]
+        if ".." in parts:
+            self.send_error(404)
+            return
+        if parts and parts[0] == "events" and len(parts) <= 2:
+            self._sendEvents(withBody, (parts[1:] or [None])[0])
+            return
+        if parts and parts[0] == "graphs":
+            graph = self._parseGraph(parts[1:])
+            if graph:
+                self._sendGraph(withBody, *graph)
+                return
+            directory = self.server.outputPath
+            parts = parts[1:]
+        else:
+            directory = self.server.htmlDirectory
+            if not parts:
+                parts = ["index.html"]
+        if not directory:
+            self.send_error(404)
+            return
+        self._sendFile(os.path.join(directory, *parts), withBody)
+
+    def _parseGraph(self, parts):
+        """ returns (cache, graph, time, size) if the path is a graph """
+        device = None
+        if len(parts) == 2:
+            device = parts[0]
+        elif len(parts) != 1:
+            return None
+        name, extension = os.path.splitext(parts[-1])
+        if extension != ".png" or device not in self.server.caches:
+            return None
+        for graphName in render.graphsDefinition:
+            if name.startswith(graphName + "_"):
+                rest = name[len(graphName) + 1:].split("_")
+                if len(rest) == 2 and rest[0] in render.times and rest[1] in render.sizes:
+                    return self.server.caches[device], graphName, rest[0], rest[1]
+        return None
+
+    def _sendGraph(self, withBody, cache, graphName, timeName, sizeName):
+        eTag = cache.getETag(graphName, timeName, sizeName)
+        if eTag in [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", eTag)
+            self.end_headers()
+            return
+        eTag, data = cache.get(graphName, timeName, sizeName)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", eTag)
+        # the browser needs to ask every time, but gets only a 304 if nothing changed
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if withBody:
+            self.wfile.write(data)
+
+    def _sendEvents(self, withBody, device):
+        # with more than one heat pump /events is the first one
+        if device is None and None not in self.server.caches and self.server.caches:
+            device = sorted(self.server.caches)[0]
+        if device not in self.server.caches:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if withBody:
+            self.wfile.flush()
+            # the connection stays open, the broadcaster sends the events
+            self.close_connection = 1
+            self.server.events.add(self.request, device)
+
+    def _sendFile(self, filename, withBody):
+        if not os.path.isfile(filename):
+            self.send_error(404)
+            return
+        f = open(filename, "rb")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", mimetypes.guess_type(filename)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            if withBody:
+                shutil.copyfileobj(f, self.wfile)
+        finally:
+            f.close()
+
+    def log_message(self, format, *args):
+        # the log file is for errors
+        pass
+
+
+class GraphServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ serves the graphs of all devices, renders is a dict device name -> Render """
+    daemon_threads = True
+    allow_reuse_address = True
+    caches = None
+    _cacheSize = None
+    events = None
+    outputPath = None
+    htmlDirectory = None
+
+    def __init__(self, address, renders, outputPath, htmlDirectory=None, cacheSize=8*1024*1024):
+        BaseHTTPServer.HTTPServer.__init__(self, address, GraphRequestHandler)
+        self.caches = {}
+        self._cacheSize = cacheSize
+        for name, aRender in renders.items():
+            self.addRender(name, aRender)
+        self.outputPath = outputPath
+        self.htmlDirectory = htmlDirectory
+        self.events = EventBroadcaster()
+
+    def addRender(self, name, aRender, flush=None):
+        """ serves the graphs of a device, flush writes its buffered values """
+        self.caches[name] = GraphCache(aRender, self._cacheSize, flush)
+
+    def start(self):
+        """ serves the requests in a thread of its own """
+        self.events.start()
+        t = threading.Thread(target=self.serve_forever)
+        t.setDaemon(True)
+        t.start()
+
+    def publish(self, device, data):
+        """ sends the json document of the actual values to the browsers """
+        self.events.publish(device, data)
+
+    def shutdown_request(self, request):
+        # the event streams are closed by the broadcaster
+        if not self.events.owns(request):
+            BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.events.stop()
+
+
+# Main program: serves the graphs of a database
+def main():
+    if len(sys.argv) < 2:
+        print "usage: graphServer.py databaseFile [port [htmlDirectory]]"
+        sys.exit(2)
+    port = 8080
+    htmlDirectory = None
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        htmlDirectory = sys.argv[3]
+    server = GraphServer(("", port), {None: render.Render(sys.argv[1])}, ".", htmlDirectory)
+    server.events.start()
+    print "Serving on port %d" % port
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@
 
 """
     This is the main module for the heatpump Monitor. It forks into the background
-    and should to a polling every 60 secs. It is quit simple at this point, no
+    and should to a polling every 60 secs (or the configured poll interval). It is quit simple at this point, no
     config files or almost no error handling.
     
     Written by Robert Penz <robert@penz.name>
@@ -25,9 +25,13 @@ import time
 import sys
 import traceback
 import os
+import signal
+from multiprocessing.pool import ThreadPool
 
 import protocol
 import storage
+import sqliteStorage
+import storageWriter
 import json
 import render
 import deamon
@@ -35,8 +39,15 @@ import threadedExec
 import config_manager
 import report
 import thresholdMonitor
+import sinkWorker
+import frameCapture
+import rrdBackend
+import graphServer
+import seriesExport
 
 config = None
+# seconds between the tries to set up a heat pump which failed
+deviceRetryInterval = 600
 
 # Print usage message and exit
 def usage(*args):
@@ -65,71 +76,229 @@ def logError(e):
     sys.stdout.flush()
     
     
+class Device:
+    """ one heat pump and everything that belongs to it """
+    name = None
+    protocol = None
+    capture = None # FrameCapture which records the serial traffic
+    storage = None
+    sqliteStorage = None
+    archive = None
+    writer = None # StorageWriter which writes into the storages above
+    json = None
+    render = None
+    series = None
+    thresholdMonitor = None
+
+    def __init__(self, name):
+        self.name = name
+        outputPath = config.getRenderOutputPath(name)
+        if not os.path.isdir(outputPath):
+            os.makedirs(outputPath)
+        if config.getCaptureDirectory(name):
+            self.capture = frameCapture.FrameCapture(config.getCaptureDirectory(name), config.getCaptureSegmentSize() * 1024 * 1024,
+                                                     config.getCaptureMaxSegments())
+        self.protocol = protocol.Protocol(config.getSerialDevice(name), config.getProtocolVersionsDirectory(name),
+                                          config.getNewStyleSerialCommunication(name),
+                                          persistentConnection=config.getPersistentConnection(name),
+                                          versionCacheFile=config.getVersionCacheFile(name),
+                                          versionsCacheFile=config.getProtocolVersionsCacheFile(name),
+                                          capture=self.capture)
+        backend = rrdBackend.getBackend(config.getStorageBackend())
+        # the writer buffers the values, the storages write what they get at once
+        self.storage = storage.Storage(config.getDatabaseFile(name), backend=backend)
+        stores = [self.storage]
+        if config.getSqliteFile(name):
+            self.sqliteStorage = sqliteStorage.SqliteStorage(config.getSqliteFile(name))
+            stores.append(self.sqliteStorage)
+        if config.getArchiveDirectory(name):
+            # imported here, so numpy is only needed with an archive
+            import archive
+            self.archive = archive.ColumnArchive(config.getArchiveDirectory(name))
+            stores.append(self.archive)
+        self.writer = storageWriter.StorageWriter(stores, config.getWriteAheadFile(name), logError,
+                                                  config.getStorageBufferSize(), config.getStorageFlushInterval())
+        self.writer.start()
+        self.json = json.Json(os.path.join(outputPath, "actual_values.json"))
+        self.render = render.Render(config.getDatabaseFile(name), outputPath, backend, config.getRenderWorkers(),
+                                    config.getRenderNiceLevel(), config.getRenderBudget())
+        self.series = seriesExport.SeriesExport(self.storage, outputPath)
+        self.thresholdMonitor = thresholdMonitor.ThresholdMonitor(config, report.Report(config))
+
+    def poll(self):
+        """ queries the heat pump, returns None if it did not work """
+        try:
+            return self.protocol.query()
+        except Exception, e:
+            # log the error, sometimes the heatpump returns an error and works seconds later again
+            if self.name:
+                print "Error: query of heat pump %s failed" % self.name
+            logError(e)
+            return None
+
+
+class Sinks:
+    """ everything that is done with the values of a poll, this runs in the
+        sink worker thread so the next poll does not need to wait for it
+    """
+    _copyThread = None # ThreadedExec for copyCommand
+    _lastRenderTime = None
+    _lastSeriesTime = None
+    _lastCopyTime = None
+    _server = None # GraphServer which sends the values to the browsers
+
+    def __init__(self, server=None):
+        self._server = server
+        # render, series and copy intervals are in minutes, the polls may happen more often
+        self._lastRenderTime = 0
+        self._lastSeriesTime = 0
+        self._lastCopyTime = 0
+        self._renderInterval = config.getRenderInterval() * 60
+        self._seriesInterval = config.getSeriesInterval() * 60
+        self._copyCommand = config.getCopyCommand()
+        self._copyInterval = config.getCopyInterval() * 60
+
+    def process(self, devices, results, pollTime):
+        """ store, render, upload and check the values of the poll """
+        for device, values in zip(devices, results):
+            if values is None:
+                device.thresholdMonitor.gotQueryError()
+                continue
+        
+            # store the stuff
+            device.writer.add(values, pollTime)
+            
+            # write the json file everything, as it does not use much cpu
+            data = device.json.write(values)
+            if self._server:
+                self._server.publish(device.name, data)
+
+            # check the values if something needs to reported
+            device.thresholdMonitor.check(values)
+                    
+        # render it if the time is right ... it takes a lot of cpu on small embedded systems
+        if self._renderInterval and pollTime - self._lastRenderTime >= self._renderInterval:
+            self._lastRenderTime = pollTime
+            for device in devices:
+                # the graphs should contain the buffered values too
+                device.writer.flush()
+                device.render.render()
+        
+        # the data series for the browser are cheap, as only the new values are appended
+        if self._seriesInterval and pollTime - self._lastSeriesTime >= self._seriesInterval:
+            self._lastSeriesTime = pollTime
+            for device in devices:
+                device.writer.flush()
+                device.series.update()
+        
+        # upload it somewhere if it fits the time, this is done once for all devices
+        if self._copyCommand and pollTime - self._lastCopyTime >= self._copyInterval:
+            self._lastCopyTime = pollTime
+            if self._copyThread and self._copyThread.isAlive():
+                print "Error: External copy program still running, cannot start it again"
+                sys.stdout.flush()
+            else:
+                self._copyThread = threadedExec.ThreadedExec(self._copyCommand)
+                self._copyThread.start()
+
+
+def createDevice(name):
+    """ returns the Device or None if it could not be set up (e.g. the heat pump
+        did not answer the version query), then it is tried again later
+    """
+    try:
+        return Device(name)
+    except Exception, e:
+        print "Error: heat pump %s could not be set up, it is tried again in %d seconds" % (name or "", deviceRetryInterval)
+        logError(e)
+        return None
+
+
+def terminate(signum, frame):
+    """ the stop command sends a SIGTERM, we exit the normal way so the
+        buffered values are written
+    """
+    # the stop command sends it every second, we need only one
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise SystemExit
+
+
 def doMonitor():
+    w = None # SinkWorker which processes the values
+    server = None # GraphServer which paints the graphs on request
+    devices = []
+    signal.signal(signal.SIGTERM, terminate)
     try:
         print "Starting ..."
         sys.stdout.flush()
         
-        p = protocol.Protocol(config.getSerialDevice(), config.getProtocolVersionsDirectory(), config.getNewStyleSerialCommunication())
-        s = storage.Storage(config.getDatabaseFile())
-        j = json.Json(os.path.join(config.getRenderOutputPath(), "actual_values.json"))
-        r = render.Render(config.getDatabaseFile(), config.getRenderOutputPath())
-        c = None # ThreadedExec for copyCommand
-        aReport = report.Report(config)
-        t = thresholdMonitor.ThresholdMonitor(config, aReport)
+        # all heat pumps are polled at the same time, so a cycle takes as long as the slowest one
+        names = config.getDevices()
+        pool = ThreadPool(len(names))
+        if config.getHttpPort():
+            server = graphServer.GraphServer((config.getHttpAddress(), config.getHttpPort()), {},
+                                             config.getRenderOutputPath(), config.getHtmlDirectory(),
+                                             config.getHttpCacheSize() * 1024 * 1024)
+            server.start()
+        # a heat pump which cannot be set up does not stop the others
+        lastSetUpTime = None
+        
+        sinks = Sinks(server)
+        w = sinkWorker.SinkWorker(logError)
+        w.start()
         
         print "Up and running"
         sys.stdout.flush()
         
-        counter = 0
-        renderInterval = config.getRenderInterval()
-        copyCommand = config.getCopyCommand()
-        copyInterval = config.getCopyInterval()
+        pollInterval = config.getPollInterval()
         while 1:
             startTime = time.time()
-            try:
-                values = p.query()
-            except Exception, e:
-                # log the error and just try it again in 120 sec - sometimes the heatpump returns an error and works
+            if len(devices) < len(names) and (lastSetUpTime is None or startTime - lastSetUpTime >= deviceRetryInterval):
+                lastSetUpTime = startTime
+                missing = [name for name in names if name not in [device.name for device in devices]]
+                newDevices = [device for device in pool.map(createDevice, missing) if device]
+                if server:
+                    for device in newDevices:
+                        server.addRender(device.name, device.render, device.writer.flush)
+                # a new list, the sink worker may still use the old one
+                devices = sorted(devices + newDevices, key=lambda device: names.index(device.name))
+            results = pool.map(Device.poll, devices)
+            
+            # the values are processed while we wait for the next poll
+            w.submit(sinks.process, devices, results, startTime)
+            
+            if results.count(None) == len(results):
+                # just try it again in 120 sec - sometimes the heatpump returns an error and works
                 # seconds later again
                 # If the query takes longer than 2 minutes, we get a negative value ... maybe a problem in rare contitions
-                logError(e)
-                t.gotQueryError()
                 time.sleep(120 - (time.time() - startTime))
                 continue
             
-            # store the stuff
-            s.add(values)
-            
-            # write the json file everything, as it does not use much cpu
-            j.write(values)
-                        
-            # render it if the time is right ... it takes a lot of cpu on small embedded systems
-            if counter % renderInterval == 0:
-                r.render()
-            
-            # upload it somewhere if it fits the time
-            if copyCommand and counter % copyInterval == 0:
-                if c and c.isAlive():
-                    print "Error: External copy program still running, cannot start it again"
-                    sys.stdout.flush()
-                else:
-                    c = threadedExec.ThreadedExec(copyCommand)
-                    c.start()
-            counter += 1
-            
-            # at last check the values if something needs to reported
-            t.check(values)
-            
-            # lets make sure it is aways 60 secs interval, no matter how long the last run took
-            sleepTime = 61 - (time.time() - startTime)
+            # lets make sure it is aways the same interval, no matter how long the last run took
+            sleepTime = pollInterval + 1 - (time.time() - startTime)
             if sleepTime < 0:
-                print "System is too slow for 60 sec interval by %d seconds" % abs(int(sleepTime))
+                print "System is too slow for %d sec interval by %d seconds" % (pollInterval, abs(int(sleepTime)))
             else:
                 time.sleep(sleepTime)
     except Exception, e:
         # make sure the error got logged
         logError(e)
+    finally:
+        # process what is still queued and write the buffered values
+        if w:
+            w.stop()
+        if server:
+            server.stop()
+        for device in devices:
+            device.protocol.close()
+            if device.capture:
+                device.capture.close()
+            device.writer.stop()
+            device.render.close()
+            if device.sqliteStorage:
+                device.sqliteStorage.close()
+            if device.archive:
+                device.archive.close()
 
 # Main program: parse command line and start processing
 def main():
@@ -0,0 +1,166 @@
+/*
+ * Paints the charts of heatpumpMonitor in the browser from the data series
+ * (graphs/series_<range>.json) written by seriesExport.py. The first line of
+ * a series file describes the sources and graphs, every other line is a
+ * point [time, value, ...] in the order of the sources.
+ */
+
+var charts = {
+	colors: {back: "#333333", grid: "#666666", axis: "#FFFFFF", font: "#FFFFFF"},
+
+	parse: function(text) {
+		var lines = text.split("\n");
+		var series = JSON.parse(lines[0]);
+		series.points = [];
+		for (var i = 1; i < lines.length; i++) {
+			if (lines[i]) {
+				series.points.push(JSON.parse(lines[i]));
+			}
+		}
+		return series;
+	},
+
+	load: function(timeName, container) {
+		$.ajax({
+			url: "graphs/series_" + timeName + ".json",
+			dataType: "text",
+			cache: false,
+			success: function(text) {
+				var series = charts.parse(text);
+				container.empty();
+				$.each(series.graphs, function(i, graph) {
+					var canvas = $('<canvas width="800" height="300"></canvas>');
+					container.append(canvas);
+					charts.paint(canvas[0], series, graph);
+				});
+			},
+			error: function() {
+				container.html("The data series are not available, set seriesInterval in the config file.");
+			}
+		});
+	},
+
+	paint: function(canvas, series, graph) {
+		var ctx = canvas.getContext("2d");
+		var left = 50, right = 10, top = 25, bottom = 40;
+		var width = canvas.width - left - right, height = canvas.height - top - bottom;
+		var end = series.points.length ? series.points[series.points.length - 1][0] : new Date().getTime() / 1000;
+		var start = end - series.time;
+		var columns = [];
+		var min = Infinity, max = -Infinity;
+		$.each(graph.sources, function(i, source) {
+			var column = $.inArray(source.name, series.sources) + 1;
+			columns.push(column);
+			$.each(series.points, function(j, point) {
+				var value = point[column];
+				if (point[0] >= start && value !== null) {
+					min = Math.min(min, value);
+					max = Math.max(max, value);
+				}
+			});
+		});
+		if (min > max) {
+			min = 0;
+			max = 1;
+		}
+		if (graph.sources.some(function(source) { return source.type == "area"; })) {
+			min = Math.min(min, 0);
+		}
+		if (min == max) {
+			max = min + 1;
+		}
+		var x = function(t) { return left + (t - start) / series.time * width; };
+		var y = function(v) { return top + height - (v - min) / (max - min) * height; };
+
+		ctx.fillStyle = charts.colors.back;
+		ctx.fillRect(0, 0, canvas.width, canvas.height);
+		ctx.font = "11px sans-serif";
+		ctx.fillStyle = charts.colors.font;
+		ctx.textAlign = "center";
+		ctx.fillText(graph.title, canvas.width / 2, 15);
+
+		// the grid with the values and times
+		ctx.strokeStyle = charts.colors.grid;
+		ctx.lineWidth = 1;
+		ctx.textAlign = "right";
+		for (var i = 0; i <= 4; i++) {
+			var value = min + (max - min) * i / 4;
+			ctx.beginPath();
+			ctx.moveTo(left, Math.round(y(value)) + 0.5);
+			ctx.lineTo(left + width, Math.round(y(value)) + 0.5);
+			ctx.stroke();
+			ctx.fillText(value.toFixed(1), left - 5, y(value) + 4);
+		}
+		ctx.textAlign = "center";
+		for (var i = 0; i <= 6; i++) {
+			var t = start + series.time * i / 6;
+			var date = new Date(t * 1000);
+			var label = series.time > 2 * 86400 ? date.toLocaleDateString() : date.toLocaleTimeString().slice(0, 5);
+			ctx.fillText(label, x(t), top + height + 15);
+		}
+
+		// the areas first, so the lines are above them
+		var order = graph.sources.slice().sort(function(a, b) { return (a.type == "line") - (b.type == "line"); });
+		var baseline = y(Math.max(min, 0));
+		$.each(order, function(i, source) {
+			var column = columns[$.inArray(source, graph.sources)];
+			ctx.strokeStyle = source.color;
+			ctx.fillStyle = source.color;
+			$.each(charts.segments(series, column, start), function(j, segment) {
+				ctx.beginPath();
+				if (source.type == "area") {
+					ctx.moveTo(x(segment[0][0]), baseline);
+				} else {
+					ctx.moveTo(x(segment[0][0]), y(segment[0][1]));
+				}
+				$.each(segment, function(k, point) {
+					ctx.lineTo(x(point[0]), y(point[1]));
+				});
+				if (source.type == "area") {
+					ctx.lineTo(x(segment[segment.length - 1][0]), baseline);
+					ctx.closePath();
+					ctx.globalAlpha = 0.6;
+					ctx.fill();
+					ctx.globalAlpha = 1;
+				} else {
+					ctx.stroke();
+				}
+			});
+		});
+
+		// the legend
+		ctx.textAlign = "left";
+		var legendX = left;
+		$.each(graph.sources, function(i, source) {
+			ctx.fillStyle = source.color;
+			ctx.fillRect(legendX, top + height + 25, 8, 8);
+			ctx.fillStyle = charts.colors.font;
+			ctx.fillText(source.title, legendX + 12, top + height + 33);
+			legendX += ctx.measureText(source.title).width + 30;
+		});
+	},
+
+	// returns the connected parts of a column as lists of [time, value], a missing
+	// value or a gap of more than two steps starts a new one
+	segments: function(series, column, start) {
+		var result = [];
+		var segment = [];
+		$.each(series.points, function(i, point) {
+			var value = point[column];
+			var last = segment.length ? segment[segment.length - 1][0] : null;
+			if (value === null || point[0] < start || (last !== null && point[0] - last > 2 * series.step)) {
+				if (segment.length) {
+					result.push(segment);
+				}
+				segment = [];
+			}
+			if (value !== null && point[0] >= start) {
+				segment.push([point[0], value]);
+			}
+		});
+		if (segment.length) {
+			result.push(segment);
+		}
+		return result;
+	}
+};
@@ -12,42 +12,41 @@
 
 """
     This module is responsible for writting the json file which is used on the homepage.
+    The same document is sent to the browsers which get the values as events from the
+    http server, so it is serialized only once per poll.
     
     Written by Robert Penz <robert@penz.name>
 """
 
 import time
 
+# the values on the homepage with their units
+fields = [("dhw_temp", "&degC"), ("inside_temp", "&degC"), ("outside_temp", "&degC"), ("flow_temp", "&degC"),
+          ("return_temp", "&degC"), ("compressor_heating", ""), ("compressor_dhw", "")]
+
+def serialize(values, timestamp=None):
+    """ returns the json document of the values, it is one line """
+    if timestamp is None:
+        timestamp = time.time()
+    items = ['"time":"%s"' % time.strftime("%H:%M %d.%m.%y", time.localtime(timestamp))]
+    for name, unit in fields:
+        items.append('"%s":"%s%s"' % (name, values.get(name), unit))
+    return "{" + ",".join(items) + "}"
+
+
 class Json:
     _filename = None
 
     def __init__(self, filename="actual_values.json"):
         self._filename = filename
         
-    def write(self, values):
-        # generate actual_values.html with values
-        html = '".id":".value"'
-        degC = '&degC'
+    def write(self, values, timestamp=None):
+        """ writes actual_values.json and returns its content """
+        data = serialize(values, timestamp)
         f = open(self._filename,"w")
-        f.write('{')
-        tmpHtml = html.replace(".value", time.strftime("%H:%M %d.%m.%y", time.localtime()));
-        f.write(tmpHtml.replace(".id","time") + ',')
-        tmpHtml = html.replace(".id","dhw_temp")
-        f.write(tmpHtml.replace(".value",str(values.get('dhw_temp')) + degC) + ',')
-        tmpHtml = html.replace(".id","inside_temp")
-        f.write(tmpHtml.replace(".value",str(values.get('inside_temp')) + degC) + ',')
-        tmpHtml = html.replace(".id","outside_temp")
-        f.write(tmpHtml.replace(".value",str(values.get('outside_temp')) + degC) + ',')
-        tmpHtml = html.replace(".id","flow_temp")
-        f.write(tmpHtml.replace(".value",str(values.get('flow_temp')) + degC) + ',')
-        tmpHtml = html.replace(".id","return_temp")
-        f.write(tmpHtml.replace(".value",str(values.get('return_temp')) + degC) + ',')
-        tmpHtml = html.replace(".id","compressor_heating")
-        f.write(tmpHtml.replace(".value",str(values.get('compressor_heating')) + "") + ',')
-        tmpHtml = html.replace(".id","compressor_dhw")
-        f.write(tmpHtml.replace(".value",str(values.get('compressor_dhw')) + ""))
-        f.write('}')
+        f.write(data)
         f.close()
+        return data
 
 
 # Main program: parse command line and start processing
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module brings an existing round robin database to the data sources
+    and archives defined in storage.py, without losing its history. The
+    database is dumped by rrdtool, the xml is changed line by line while it
+    streams through us and restored into a new file, which replaces the old
+    one at the end. So only a few lines are in memory at any time.
+
+    Data sources which are not defined anymore are removed, new ones get
+    unknown values. Archives which are not defined anymore are removed, a new
+    MIN or MAX archive starts with the values of the AVERAGE archive with the
+    same resolution (if there is one), others start empty. Stop the monitor
+    while migrating, values written in between are lost.
+
+    usage: migrate.py [options] databaseFile ...
+"""
+
+import os
+import re
+import sys
+import time
+import tempfile
+import optparse
+import subprocess
+
+import storage
+
+_valuePattern = re.compile(r"<v>\s*([^<]*?)\s*</v>")
+_cfPattern = re.compile(r"<cf>\s*\w+\s*</cf>")
+_namePattern = re.compile(r"<name>\s*(\S+)\s*</name>")
+
+def _tag(line):
+    """ returns the first tag of the line, e.g. "ds" or "/ds" """
+    line = line.strip()
+    if not line.startswith("<") or line.startswith("<!--"):
+        return None
+    return line[1:].split(">", 1)[0].split()[0]
+
+def readLayout(filename):
+    """ returns (data sources, archives) of the database, the archives are
+        (cf, steps, rows) tuples in the order of the file
+    """
+    p = subprocess.Popen(["rrdtool", "info", filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = p.communicate()
+    if p.returncode:
+        raise IOError, "Error: rrdtool info failed: %s" % error.strip()
+    sources = {}
+    archives = {}
+    for line in output.splitlines():
+        key, sep, value = line.partition(" = ")
+        value = value.strip('"')
+        if key.startswith("ds[") and key.endswith("].index"):
+            sources[int(value)] = key[3:-len("].index")]
+        elif key.startswith("rra[") and key.count(".") == 1:
+            index, field = key[4:].split("].")
+            archives.setdefault(int(index), {})[field] = value
+    result = []
+    for index in sorted(archives):
+        result.append((archives[index]["cf"], int(archives[index]["pdp_per_row"]), int(archives[index]["rows"])))
+    return tuple([sources[index] for index in sorted(sources)]), tuple(result)
+
+
+class Migration:
+    # the layout of the existing database and the one we want
+    _sources = None
+    _archives = None
+    _newSources = None
+    _newArchives = None
+    # for each existing archive the list of (new archive, whether it is copied or seeded)
+    _outputs = None
+    # the new archives which have no existing one to start with
+    _emptyArchives = None
+
+    def __init__(self, sources, archives, newSources=storage.dataSources, newArchives=storage.archives):
+        self._sources = sources
+        self._archives = archives
+        self._newSources = newSources
+        self._newArchives = newArchives
+        self._outputs = [[] for archive in archives]
+        self._emptyArchives = []
+        for cf, steps, rows in newArchives:
+            for i, (oldCf, oldSteps, oldRows) in enumerate(archives):
+                if (oldCf, oldSteps) == (cf, steps):
+                    self._outputs[i].append(((cf, steps, rows), False))
+                    break
+            else:
+                for i, (oldCf, oldSteps, oldRows) in enumerate(archives):
+                    if (oldCf, oldSteps) == ("AVERAGE", steps) and cf in ("MIN", "MAX"):
+                        self._outputs[i].append(((cf, steps, rows), True))
+                        break
+                else:
+                    self._emptyArchives.append((cf, steps, rows))
+
+    def isNeeded(self):
+        """ true if the database does not have the wanted layout """
+        return tuple(self._sources) != tuple(self._newSources) or sorted(self._archives) != sorted(self._newArchives)
+
+    def describe(self):
+        """ returns the changes as list of lines for humans """
+        result = []
+        for source in self._sources:
+            if source not in self._newSources:
+                result.append("remove data source %s" % source)
+        for source in self._newSources:
+            if source not in self._sources:
+                result.append("add data source %s" % source)
+        if [s for s in self._sources if s in self._newSources] != [s for s in self._newSources if s in self._sources]:
+            result.append("reorder data sources")
+        for archive, outputs in zip(self._archives, self._outputs):
+            if not outputs:
+                result.append("remove archive %s %d steps %d rows" % archive)
+            for newArchive, seeded in outputs:
+                if seeded:
+                    result.append("add archive %s %d steps %d rows from %s" % (newArchive + (archive[0],)))
+                elif newArchive != archive:
+                    result.append("resize archive %s %d steps from %d to %d rows" % (archive + (newArchive[2],)))
+        for archive in self._emptyArchives:
+            result.append("add empty archive %s %d steps %d rows" % archive)
+        return result
+
+    ## ###############################  the xml transformation  ################################################
+
+    def _columns(self, values):
+        """ returns the values in the order of the new data sources, new ones are NaN """
+        result = []
+        for source in self._newSources:
+            if source in self._sources:
+                result.append(values[self._sources.index(source)])
+            else:
+                result.append("NaN")
+        return result
+
+    def _dsBlock(self, source):
+        """ the data source section of a new source """
+        return ["\t<ds>\n",
+                "\t\t<name> %s </name>\n" % source,
+                "\t\t<type>GAUGE</type>\n",
+                "\t\t<minimal_heartbeat>%d</minimal_heartbeat>\n" % storage.heartbeat,
+                "\t\t<min>NaN</min>\n",
+                "\t\t<max>NaN</max>\n",
+                "\t\t<last_ds>U</last_ds>\n",
+                "\t\t<value>NaN</value>\n",
+                "\t\t<unknown_sec> 0 </unknown_sec>\n",
+                "\t</ds>\n"]
+
+    def _cdpBlock(self):
+        """ the consolidation state of a new source within an archive """
+        return ["\t\t\t<ds>\n",
+                "\t\t\t<primary_value>NaN</primary_value>\n",
+                "\t\t\t<secondary_value>NaN</secondary_value>\n",
+                "\t\t\t<value>NaN</value>\n",
+                "\t\t\t<unknown_datapoints>0</unknown_datapoints>\n",
+                "\t\t\t</ds>\n"]
+
+    def _nanRow(self):
+        return "\t\t\t<row>%s</row>\n" % ("<v>NaN</v>" * len(self._newSources))
+
+    def _writeArchiveHead(self, write, cf, header, cdpBlocks, seeded=False):
+        """ writes everything of an archive up to its rows, a seeded archive starts
+            with an empty consolidation state as the one of the other function
+            (e.g. the running sum of AVERAGE) means something else
+        """
+        for line in header:
+            write(_cfPattern.sub("<cf>%s</cf>" % cf, line))
+        write("\t\t<cdp_prep>\n")
+        for block in self._columns(cdpBlocks):
+            if block == "NaN" or seeded:
+                block = self._cdpBlock()
+            for line in block:
+                write(line)
+        write("\t\t</cdp_prep>\n")
+        write("\t\t<database>\n")
+
+    def transform(self, lines, write):
+        """ reads the lines of rrdtool dump and writes the xml of the new layout """
+        spools = []
+        sourceBlocks = {}
+        block = None   # the lines of the actual ds section
+        rra = -1       # the index of the actual archive
+        header = None  # the lines of the archive before its consolidation state
+        cdpBlocks = None
+        outputs = None # (write function, rows to skip, rows to add) for the actual archive
+        for line in lines:
+            tag = _tag(line)
+            # the rows start with a comment with their time
+            if "<row>" in line:
+                tag = "row"
+            if block is not None:
+                # within a ds section, they are small
+                block.append(line)
+                if tag == "/ds":
+                    if header is None:
+                        sourceBlocks[_namePattern.search("".join(block)).group(1)] = block
+                    else:
+                        cdpBlocks.append(block)
+                    block = None
+            elif tag == "ds":
+                block = [line]
+            elif tag == "rra":
+                if rra == -1:
+                    # all data sources are read, write them in the new order
+                    for source in self._newSources:
+                        for blockLine in sourceBlocks.get(source) or self._dsBlock(source):
+                            write(blockLine)
+                rra += 1
+                header = [line]
+                cdpBlocks = []
+            elif tag == "cdp_prep" or tag == "/cdp_prep":
+                pass
+            elif tag == "database":
+                cf, steps, rows = self._archives[rra]
+                outputs = []
+                for (newCf, newSteps, newRows), seeded in self._outputs[rra]:
+                    if not outputs:
+                        function = write
+                    else:
+                        # only one archive can be written at a time, the others are written at the end
+                        spool = tempfile.TemporaryFile()
+                        spools.append(spool)
+                        function = spool.write
+                    self._writeArchiveHead(function, newCf, header, cdpBlocks, seeded)
+                    # the oldest rows are first
+                    for i in xrange(newRows - rows):
+                        function(self._nanRow())
+                    outputs.append([function, max(rows - newRows, 0)])
+            elif tag == "row":
+                values = self._columns(_valuePattern.findall(line))
+                row = "%s<row>%s</row>\n" % (line[:line.index("<row>")], "".join(["<v>%s</v>" % value for value in values]))
+                for output in outputs:
+                    if output[1]:
+                        output[1] -= 1
+                    else:
+                        output[0](row)
+            elif tag == "/database":
+                for function, skip in outputs:
+                    function(line)
+            elif tag == "/rra":
+                for function, skip in outputs:
+                    function(line)
+                header = []
+            elif tag == "/rrd":
+                for spool in spools:
+                    spool.seek(0)
+                    for spoolLine in spool:
+                        write(spoolLine)
+                    spool.close()
+                for cf, steps, rows in self._emptyArchives:
+                    self._writeEmptyArchive(write, cf, steps, rows)
+                write(line)
+            elif header is not None and rra >= 0 and not cdpBlocks and outputs is None:
+                # the lines of the archive before its consolidation state
+                header.append(line)
+            elif rra == -1 or outputs is None:
+                # the head of the file
+                write(line)
+            else:
+                # e.g. comments between the archives
+                for function, skip in outputs:
+                    function(line)
+            if tag == "/rra":
+                outputs = None
+
+    def _writeEmptyArchive(self, write, cf, steps, rows):
+        header = ["\t<rra>\n",
+                  "\t\t<cf>%s</cf>\n" % cf,
+                  "\t\t<pdp_per_row>%d</pdp_per_row>\n" % steps,
+                  "\t\t<params>\n",
+                  "\t\t<xff>0.0000000000e+00</xff>\n",
+                  "\t\t</params>\n"]
+        self._writeArchiveHead(write, cf, header, ["NaN"] * len(self._sources))
+        for i in xrange(rows):
+            write(self._nanRow())
+        write("\t\t</database>\n")
+        write("\t</rra>\n")
+
+
+def migrate(filename, backup=False):
+    """ migrates the database, returns False if it has already the wanted layout """
+    sources, archives = readLayout(filename)
+    m = Migration(sources, archives)
+    if not m.isNeeded():
+        return False
+    newFile = filename + ".migrate"
+    if os.path.exists(newFile):
+        os.remove(newFile)
+    dump = subprocess.Popen(["rrdtool", "dump", filename], stdout=subprocess.PIPE)
+    restore = subprocess.Popen(["rrdtool", "restore", "-", newFile], stdin=subprocess.PIPE)
+    try:
+        m.transform(dump.stdout, restore.stdin.write)
+    finally:
+        restore.stdin.close()
+        dump.stdout.close()
+    if dump.wait() or restore.wait():
+        if os.path.exists(newFile):
+            os.remove(newFile)
+        raise IOError, "Error: migration of %s failed" % filename
+    if backup:
+        if os.path.exists(filename + ".bak"):
+            os.remove(filename + ".bak")
+        os.link(filename, filename + ".bak")
+    # the rename replaces the old file at once
+    os.rename(newFile, filename)
+    return True
+
+
+# Main program: parse command line and start processing
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] databaseFile ...")
+    parser.add_option("-n", "--dry-run", action="store_true", help="only print what would be changed")
+    parser.add_option("-b", "--backup", action="store_true", help="keep the old database as databaseFile.bak")
+    options, args = parser.parse_args()
+    if not args:
+        parser.error("a database file is required")
+
+    for filename in args:
+        sources, archives = readLayout(filename)
+        changes = Migration(sources, archives).describe()
+        if not changes:
+            print "%s: nothing to do" % filename
+            continue
+        print "%s:" % filename
+        for change in changes:
+            print "    %s" % change
+        if options.dry_run:
+            continue
+        sys.stdout.flush()
+        startTime = time.time()
+        migrate(filename, options.backup)
+        print "    done in %d seconds" % (time.time() - startTime)
+
+if __name__ == '__main__':
+    main()
@@ -21,11 +21,18 @@
 import serial
 import struct
 import sys
+import os
 import time
+import ConfigParser
 import protocolVersions
+import frameCapture
 
 # normally no need to change it
 serialTimeout = 5
+# how many polls in a row may fail before a persistent connection gets reopened
+maxSessionFailures = 3
+# how many frames in a row may fail to be captured before capturing is stopped
+maxCaptureErrors = 10
 
 # protocol constants
 STARTCOMMUNICATION = "\x02"
@@ -87,6 +94,77 @@ def addChecksum(s):
     return (_calcChecksum(s) + s)
 
 
+class FrameReceiver:
+    """ Receives a response frame from the heat pump. Instead of reading one
+        byte at a time it reads everything the serial line has buffered in one
+        call and un-escapes it chunk wise into a preallocated bytearray. The
+        counters allow to compare the number of read calls with the number
+        of received bytes.
+    """
+    _buffer = None
+    readCalls = None
+    bytesRead = None
+
+    def __init__(self, bufferSize=256):
+        self._buffer = bytearray(bufferSize)
+        self.readCalls = 0
+        self.bytesRead = 0
+
+    def receive(self, ser, queryName):
+        """ reads one frame from ser and returns the header and the un-escaped
+            data, the END flag is not part of the returned string
+        """
+        length = 0
+        escaping = False
+        while 1:
+            # read what is there, but at least one byte - this blocks until the timeout
+            chunk = ser.read(ser.inWaiting() or 1)
+            self.readCalls += 1
+            if not chunk:
+                raise IOError, "Error: data stream brocken during %s reponse" % queryName
+            self.bytesRead += len(chunk)
+
+            position = 0
+            if length < 2: # first 2 chars should be the header
+                position = min(2 - length, len(chunk))
+                self._store(length, chunk[:position])
+                length += position
+                if length == 2 and self._buffer[:2] != BEGIN:
+                    raise IOError, "Error: wrong response header for %s request" % queryName
+
+            while position < len(chunk):
+                if escaping:
+                    tmp = chunk[position]
+                    if tmp == END: # special handling
+                        # we just stop reading, anything after the END flag is not part of the frame
+                        return str(self._buffer[:length])
+                    elif tmp == ESCAPE: # just add the char as it got escaped
+                        self._store(length, tmp)
+                        length += 1
+                        escaping = False
+                        position += 1
+                    else:
+                        raise IOError, "Error: some char (%02x) got escaped which should not in %s request" % (ord(tmp), queryName)
+                else:
+                    # copy everything up to the next escape char in one go
+                    nextEscape = chunk.find(ESCAPE, position)
+                    if nextEscape == -1:
+                        nextEscape = len(chunk)
+                    self._store(length, chunk[position:nextEscape])
+                    length += nextEscape - position
+                    position = nextEscape
+                    if position < len(chunk): # this char is used for escaping
+                        escaping = True # do add nothing
+                        position += 1
+
+    def _store(self, offset, data):
+        """ copies data into the buffer at offset and grows it if required """
+        end = offset + len(data)
+        if end > len(self._buffer):
+            self._buffer.extend(bytearray(max(end - len(self._buffer), len(self._buffer))))
+        self._buffer[offset:end] = data
+
+
 class Protocol:
     # The device we talk to
     _serialDevice = None
@@ -101,20 +179,132 @@ class Protocol:
     
     # The object which does the serial talking
     _ser = None
+    
+    # The object which reads the response frames
+    _receiver = None
+    
+    # keep the serial connection open between the polls
+    _persistentConnection = None
+    _sessionFailures = None
+    
+    # when each query was done the last time and what it returned
+    _lastQueryTimes = None
+    _lastValues = None
+    
+    # the file the detected version gets stored in and if it was checked since the start
+    _versionCacheFile = None
+    _versionChecked = None
+    
+    # records the received frames if set
+    _capture = None
+    _captureErrors = None
+    _requestId = None
 
-    def __init__(self, serialDevice="/dev/ttyS0", versionsConfigDirectory = "/usr/local/share/heatpump/protocolVersions", newStyleSerialCommunication = True,  debug=False):
+    def __init__(self, serialDevice="/dev/ttyS0", versionsConfigDirectory = "/usr/local/share/heatpump/protocolVersions", newStyleSerialCommunication = True,  debug=False, persistentConnection=False,
+                 versionCacheFile=None, versionsCacheFile=None, capture=None):
         self._serialDevice = serialDevice
         self._debug = debug
         self._newStyleSerialCommunication = newStyleSerialCommunication
+        self._persistentConnection = persistentConnection
+        self._sessionFailures = 0
+        self._lastQueryTimes = {}
+        self._lastValues = {}
+        self._receiver = FrameReceiver()
+        self._versionCacheFile = versionCacheFile
+        self._capture = capture
+        self._requestId = 0
         
         # get everything we need for the version specific stuff
-        self._protocolVersions = protocolVersions.ProtocolVersions(versionsConfigDirectory)
-        self._version = self.versionQuery()
-        print "Heatpump reports Version %s" % self._version
+        self._protocolVersions = protocolVersions.ProtocolVersions(versionsConfigDirectory, versionsCacheFile)
+        # with a cached version we don't need to talk to the heat pump at startup,
+        # the version gets checked with the first poll
+        self._version = self._readVersionCache()
+        if self._version:
+            print "Using cached heat pump version %s, it gets checked with the first poll" % self._version
+            self._versionChecked = False
+        else:
+            self._version = self.versionQuery()
+            print "Heatpump reports Version %s" % self._version
+            self._versionChecked = True
         sys.stdout.flush()
         self._config = self._protocolVersions.getConfig(self._version)
         print "Using protocol definition from %s (%s)" % (self._config["author"], self._config["comment"])
         sys.stdout.flush()
+        self._writeVersionCache()
+
+    def _readVersionCache(self):
+        """ returns the version stored in the cache file or None if there is no usable one """
+        if not self._versionCacheFile or not os.path.isfile(self._versionCacheFile):
+            return None
+        try:
+            p = ConfigParser.ConfigParser()
+            p.read(self._versionCacheFile)
+            version = p.get("Version", "version")
+            # the definition for this version may have been removed
+            self._protocolVersions.getConfig(version)
+            return version
+        except (ConfigParser.Error, ValueError):
+            return None
+
+    def _writeVersionCache(self):
+        """ stores the version and the used protocol definition for the next start """
+        if not self._versionCacheFile:
+            return
+        try:
+            f = open(self._versionCacheFile, "w")
+            f.write("[Version]\nversion = %s\ndefinition = %s\n" % (self._version, self._config["filename"]))
+            f.close()
+        except IOError, e:
+            print "Error: could not write the version cache file %s (%s)" % (self._versionCacheFile, e)
+            sys.stdout.flush()
+
+    def _record(self, queryName, frame, error):
+        """ captures the frame, a failing capture (e.g. a full disk) must not stop the polls """
+        try:
+            self._capture.record(queryName, self._requestId, frame, error and frameCapture.flagInvalid or 0)
+            self._captureErrors = 0
+        except Exception, e:
+            self._captureErrors = (self._captureErrors or 0) + 1
+            print "Error: could not capture the %s frame (%s)" % (queryName, e)
+            if self._captureErrors >= maxCaptureErrors:
+                print "Error: capturing stopped after %d failed frames" % self._captureErrors
+                self._capture = None
+            sys.stdout.flush()
+
+    def _removeVersionCache(self):
+        if not self._versionCacheFile or not os.path.isfile(self._versionCacheFile):
+            return
+        try:
+            os.remove(self._versionCacheFile)
+        except OSError, e:
+            print "Error: could not remove the version cache file %s (%s)" % (self._versionCacheFile, e)
+            sys.stdout.flush()
+
+    def _checkVersion(self):
+        """ compares the cached version with the one the heat pump reports, if it
+            changed (e.g. a firmware upgrade) the protocol definition is switched
+        """
+        version = self._getVersion()
+        if version == self._version:
+            self._versionChecked = True
+            return
+        print "Heatpump reports Version %s instead of the cached %s" % (version, self._version)
+        sys.stdout.flush()
+        try:
+            config = self._protocolVersions.getConfig(version)
+        except ValueError:
+            # the cache is wrong, the next start asks the heat pump again
+            self._removeVersionCache()
+            raise
+        self._config = config
+        self._version = version
+        self._versionChecked = True
+        print "Using protocol definition from %s (%s)" % (self._config["author"], self._config["comment"])
+        sys.stdout.flush()
+        # the values of the old definition are not valid anymore
+        self._lastQueryTimes = {}
+        self._lastValues = {}
+        self._writeVersionCache()
 
 
     def _establishConnection(self):
@@ -146,6 +336,27 @@ class Protocol:
             self._ser = None
             # we wait 1 sec, as it should be avoided that the connection is opened to fast again
             time.sleep(1)
+
+    def _resync(self):
+        """ tries to get the heat pump back into a state where it accepts requests
+            without reopening the connection, returns True if it worked
+        """
+        self._ser.flushInput()
+        self._ser.write(STARTCOMMUNICATION)
+        return self._ser.read(1) == ESCAPE
+
+    def _sessionFailure(self):
+        """ called if a poll failed with a persistent connection, the connection
+            is only reopened with the next poll if the re-sync does not work or
+            too many polls failed in a row
+        """
+        self._sessionFailures += 1
+        try:
+            if self._ser and self._sessionFailures < maxSessionFailures and self._resync():
+                return
+        except serial.SerialException:
+            pass
+        self._closeConnection()
     
     def _get(self, queryName,  queryRequest,  queryResponseLength):
         """ internal method which does the real quering - provide it with a dict
@@ -165,8 +376,10 @@ class Protocol:
                 success = True
             else:
                 retry += 1
-                self._closeConnection()
-                self._establishConnection()
+                # a persistent connection gets first a re-sync before we reconnect
+                if not self._persistentConnection or not self._resync():
+                    self._closeConnection()
+                    self._establishConnection()
         if not success:
             raise IOError, "Error: Tried the request %s five times but the heat pump did not anwser correctly." % queryName
         
@@ -174,30 +387,7 @@ class Protocol:
         self._ser.write(ESCAPE)
         
         # we read data until we get the END flag, but not if the END flag is not escaped
-        s = ""
-        escaping = False
-        while 1:
-            tmp = self._ser.read(1)
-            if not tmp:
-                raise IOError, "Error: data stream brocken during %s reponse" % queryName
-        
-            if len(s) < 2: # first 2 chars should be the header
-                s += tmp
-                if len(s) == 2 and s != BEGIN:
-                    raise IOError, "Error: wrong response header for %s request" % queryName
-            else:
-                if escaping:
-                    if tmp == END: # special handling
-                        break # we just stop reading
-                    elif tmp == ESCAPE: # just add the char as it got escaped
-                        s += tmp
-                        escaping = False
-                    else:
-                        raise IOError, "Error: some char (%02x) got escaped which should not in %s request" % (ord(tmp), queryName)                    
-                elif tmp == ESCAPE: # this char is used for escaping
-                    escaping = True # do add nothing
-                else: # normal, just add the char
-                    s += tmp
+        s = self._receiver.receive(self._ser, queryName)
 
         # don't really know why, but it seems necessary for some versions
         if self._config and self._config["globalReplaceString"]:
@@ -205,12 +395,20 @@ class Protocol:
             
         # check the checksum and if the response matches the request
         s = s[len(BEGIN):]
+        error = None
         if len(s) - 2 != queryResponseLength: # 2 = the checksum and the response id.
-            raise IOError,  "Error: the received %s response has an invalid length (%d instead of %d)" % (queryName, len(s) - 2, queryResponseLength)
+            error = "Error: the received %s response has an invalid length (%d instead of %d)" % (queryName, len(s) - 2, queryResponseLength)
         elif not verifyChecksum(s):
-            raise IOError,  "Error: the received %s response has an invalid checksum" % queryName
+            error = "Error: the received %s response has an invalid checksum" % queryName
         elif s[1] != queryRequest:
-            raise IOError,  "Error: the received %s response has an other id (%02x) as the request " % (queryName, ord(s[1]))
+            error = "Error: the received %s response has an other id (%02x) as the request " % (queryName, ord(s[1]))
+        
+        # keep the frame, the invalid ones are the interesting ones for debugging
+        self._requestId += 1
+        if self._capture:
+            self._record(queryName, s, error)
+        if error:
+            raise IOError, error
         payload = s[2:]
 
         # all worked, now we need to reset the connection in a state we can talk again
@@ -234,14 +432,7 @@ class Protocol:
     def _getValues(self, queryData):
         """ extracts the values configured for this query """
         s = self._get(queryData["name"],  queryData["request"],  queryData["responseLength"])
-        result = {}
-        for entry in queryData["values"]:
-            # diffent types need to be converted differently
-            if entry["type"] == "fixedPoint":
-                result[entry["name"]] =  convert2Number(s[entry["position"]:entry["position"] + entry["size"]], entry["fixedDecimals"])
-            elif entry["type"] == "DateTime":
-                result[entry["name"]] =  convert2DateTime(s[entry["position"]:entry["position"] + entry["size"]], entry["separator"])
-        return result
+        return queryData["decodePlan"].decode(s)
     
     def versionQuery(self):
         """ the version query is seperated from the other as it is fixed and not queried every time """
@@ -251,16 +442,56 @@ class Protocol:
         finally:
             self._closeConnection()
     
+    def _dueQueries(self, now):
+        """ returns the queries which need to be done now, a query without an
+            interval is done every time
+        """
+        result = []
+        for query in self._config["queries"]:
+            lastQueryTime = self._lastQueryTimes.get(query["name"])
+            if lastQueryTime is None or now - lastQueryTime >= query["interval"]:
+                result.append(query)
+        return result
+
+    def _doQueries(self, now):
+        """ does the due queries and remembers their values """
+        if not self._versionChecked:
+            self._checkVersion()
+        for query in self._dueQueries(now):
+            self._lastValues[query["name"]] = self._getValues(query)
+            self._lastQueryTimes[query["name"]] = now
+
     def query(self):
-        """ this method return you a dict with the retrieved values from the heat pump """
+        """ this method return you a dict with the retrieved values from the heat pump,
+            values of queries which are not due are the ones of their last query
+        """
+        now = time.time()
+        if not self._persistentConnection:
+            try:
+                self._establishConnection()
+                self._doQueries(now)
+            finally:
+                self._closeConnection()
+        else:
+            # the connection stays open till something goes wrong
+            try:
+                if not self._ser:
+                    self._establishConnection()
+                self._doQueries(now)
+            except:
+                self._sessionFailure()
+                raise
+            self._sessionFailures = 0
+
+        # merge in the configured order, so the later query wins as before
         result = {}
-        try:
-            self._establishConnection()
-            for query in self._config["queries"]:
-                result.update(self._getValues(query))
-        finally:
-            self._closeConnection()
+        for query in self._config["queries"]:
+            result.update(self._lastValues.get(query["name"], {}))
         return result
+
+    def close(self):
+        """ closes a connection which got kept open between the polls """
+        self._closeConnection()
         
 
 # Main program: only for testing
@@ -268,6 +499,7 @@ def main():
     aP = Protocol(versionsConfigDirectory="protocolVersions/")
     #print aP._config
     print aP.query()
+    print "%d bytes received with %d read calls" % (aP._receiver.bytesRead, aP._receiver.readCalls)
 
 
 if __name__ == '__main__':
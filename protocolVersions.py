@@ -20,77 +20,302 @@
 
 from ConfigParser import *
 import os
+import sys
+import struct
+import cPickle
+import hashlib
+
+# the first bytes of a definitions cache file, change it if the format changes
+cacheMagic = "HPMPVC02"
+# the index and every config in the cache are checked with their sha1
+hashLength = hashlib.sha1().digest_size
+
+# the struct codes of the supported value types and sizes
+fixedPointCodes = {1: "b", 2: "h"}
+dateTimeCodes = {2: "H"}
+
+
+class DecodePlan:
+    """ A query response gets decoded with this precompiled plan. The values are
+        packed into as few struct.Struct objects as possible (only overlapping
+        values need an additional one), so decoding is one unpack per struct
+        and one pass to scale the fixed point numbers.
+    """
+    _structs = None
+    _fields = None
+
+    def __init__(self, values):
+        self._fields = []
+        groups = []
+        for entry in values:
+            if entry["type"] == "fixedPoint":
+                code = fixedPointCodes.get(entry["size"])
+                if entry["fixedDecimals"] == 0:
+                    self._fields.append((entry["name"], None, None))
+                else:
+                    self._fields.append((entry["name"], 10.0**entry["fixedDecimals"], None))
+            else:
+                code = dateTimeCodes.get(entry["size"])
+                self._fields.append((entry["name"], None, entry["separator"]))
+            if not code:
+                raise ValueError, "Error: value %s has an unsupported size of %d bytes" % (entry["name"], entry["size"])
+            groups.append((entry["position"], entry["size"], code, len(self._fields) - 1))
+
+        # now pack the values sorted by position into structs, a value which
+        # overlaps with the ones before needs to go into an other struct
+        structs = []
+        groups.sort()
+        for position, size, code, index in groups:
+            for tmp in structs:
+                if tmp["end"] <= position:
+                    break
+            else:
+                tmp = {"end": 0, "format": ">", "indices": []}
+                structs.append(tmp)
+            tmp["format"] += "x" * (position - tmp["end"]) + code
+            tmp["end"] = position + size
+            tmp["indices"].append(index)
+        self._structs = [(struct.Struct(tmp["format"]), tmp["indices"]) for tmp in structs]
+
+    def __getstate__(self):
+        # struct.Struct objects can not be pickled, but their formats
+        return {"fields": self._fields, "structs": [(aStruct.format, indices) for aStruct, indices in self._structs]}
+
+    def __setstate__(self, state):
+        self._fields = state["fields"]
+        self._structs = [(struct.Struct(f), indices) for f, indices in state["structs"]]
+
+    def decode(self, s):
+        """ returns a dict with the values decoded from the response s """
+        raw = [None] * len(self._fields)
+        for aStruct, indices in self._structs:
+            for index, value in zip(indices, aStruct.unpack_from(s)):
+                raw[index] = value
+
+        # the names are set in the configured order, so the later wins if a name is used twice
+        result = {}
+        for (name, divisor, separator), value in zip(self._fields, raw):
+            if separator is not None:
+                # the date and time values are little endian
+                tmp = "%04d" % (((value & 0xFF) << 8) | (value >> 8))
+                result[name] = tmp[:2] + separator + tmp[2:]
+            elif divisor:
+                result[name] = value / divisor
+            else:
+                result[name] = value
+        return result
+
+
+def parseConfig(filename):
+    """ parses the config into our internal format, not much error handling is done
+        at this point as these files should be only created by "experts" ;-)
+    """
+    config = {"filename": filename}
+
+    p = ConfigParser()
+    p.read(filename)
+
+    # global section stuff
+    versions = p.get("Global", "versions").strip().split()
+    config["author"] = p.get("Global", "author")
+    config["comment"] = p.get("Global", "comment")
+
+    # later this can be extended for multible replaces
+    tmp = p.get("Global", "globalReplaceString").strip().decode("string-escape").split()
+    if not tmp:
+        config["globalReplaceString"] = None
+    else:
+        config["globalReplaceString"] = tmp
+
+    # now jump to the query specific settings
+    queries = []
+    for queryName in p.get("Global", "queries").strip().split():
+        query = {"name": queryName}
+        query["comment"] = p.get(queryName, "comment")
+        query["request"] = p.get(queryName, "request").decode("string-escape")
+        query["responseLength"] = p.getint(queryName, "responseLength")
+        # how often the query should be done, 0 means with every poll
+        if p.has_option(queryName, "interval"):
+            query["interval"] = p.getint(queryName, "interval")
+        else:
+            query["interval"] = 0
+
+        # now the value part in the correct order
+        tmp = p.items(queryName)
+        tmp.sort()
+        vs = []
+        for name, value in tmp:
+            if not name.startswith("value"):
+                continue
+            v = value.strip().split()
+            if v[2].lower() == "fixedpoint":
+                vs.append({"name": v[0], "position": int(v[1]), "type": "fixedPoint", "size": int(v[3]), "fixedDecimals": int(v[4])})
+            elif v[2].lower() == "datetime":
+                vs.append({"name": v[0], "position": int(v[1]), "type": "DateTime", "size": int(v[3]), "separator": v[4]})
+        query["values"] = vs
+        query["decodePlan"] = DecodePlan(vs)
+        queries.append(query)
+    config["queries"] = queries
+    return versions, config
+
 
 class ProtocolVersions:
     _config = None
     _versionsConfigDirectory = None
-    def __init__(self, versionsConfigDirectory):
+    
+    # with a cache file the configs are only loaded if they are requested
+    _cacheFile = None
+    _cacheIndex = None
+    
+    def __init__(self, versionsConfigDirectory, cacheFile=None):
         self._versionsConfigDirectory = versionsConfigDirectory
-        self._config = self.parseAllConfigs()
+        self._cacheFile = cacheFile
+        if cacheFile:
+            self._config = {}
+            self._cacheIndex = self._loadCacheIndex()
+            if self._cacheIndex is None:
+                self._config = self.parseAllConfigs()
+                self._writeCache()
+        else:
+            self._config = self.parseAllConfigs()
         
     
     def getConfig(self, version):
         """ returns the config specific for the request heat pumpt software version """
+        if version not in self._config and self._cacheIndex and version in self._cacheIndex["versions"]:
+            try:
+                self._config[version] = self._loadCachedConfig(version)
+            except Exception, e:
+                print "Error: the protocol versions cache %s is damaged, parsing the ini files again (%s)" % (self._cacheFile, e)
+                sys.stdout.flush()
+                self._cacheIndex = None
+                self._config = self.parseAllConfigs()
+                self._writeCache()
         try:
             return self._config[version]
         except:
             raise ValueError, "No configuration available for this software version of the heat pump."
     
+    def _listConfigFiles(self):
+        """ returns the ini files in the directory with their modification time and size """
+        result = {}
+        for filename in os.listdir(self._versionsConfigDirectory):
+            if os.path.splitext(filename)[1].lower() == ".ini":
+                s = os.stat(os.path.join(self._versionsConfigDirectory, filename))
+                result[filename] = (s.st_mtime, s.st_size)
+        return result
+    
+    def _hashConfigFile(self, filename):
+        f = open(os.path.join(self._versionsConfigDirectory, filename), "rb")
+        try:
+            return hashlib.sha1(f.read()).hexdigest()
+        finally:
+            f.close()
+
+    def _loadCacheIndex(self):
+        """ reads the index of the cache file, returns None if there is no cache
+            or it does not fit to the ini files anymore
+        """
+        try:
+            f = open(self._cacheFile, "rb")
+        except IOError:
+            return None
+        try:
+            try:
+                if f.read(len(cacheMagic)) != cacheMagic:
+                    return None
+                length = struct.unpack("<I", f.read(4))[0]
+                digest = f.read(hashLength)
+                header = f.read(length)
+                if hashlib.sha1(header).digest() != digest:
+                    return None
+                index = cPickle.loads(header)
+
+                # the cache is only valid if the ini files did not change, a changed
+                # modification time alone is ok if the content is still the same
+                files = self._listConfigFiles()
+                if set(files) != set(index["files"]):
+                    return None
+                for filename, (mtime, size) in files.items():
+                    cachedMtime, cachedSize, cachedHash = index["files"][filename]
+                    if size != cachedSize:
+                        return None
+                    if mtime != cachedMtime and self._hashConfigFile(filename) != cachedHash:
+                        return None
+                return index
+            except Exception:
+                # a damaged cache (e.g. on an sd card) is written again
+                return None
+        finally:
+            f.close()
+
+    def _loadCachedConfig(self, version):
+        """ reads just the config of this version from the cache file """
+        offset, length, digest = self._cacheIndex["versions"][version]
+        f = open(self._cacheFile, "rb")
+        try:
+            f.seek(offset)
+            blob = f.read(length)
+        finally:
+            f.close()
+        if hashlib.sha1(blob).digest() != digest:
+            raise ValueError, "Error: the cached config of version %s is damaged" % version
+        return cPickle.loads(blob)
+
+    def _writeCache(self):
+        """ writes the parsed configs into the cache file, every config is pickled on
+            its own so it can be loaded without the others
+        """
+        blobs = []
+        versions = {}
+        configs = {}
+        for version, config in self._config.items():
+            # a config can be used for more than one version
+            if config["filename"] not in configs:
+                configs[config["filename"]] = len(blobs)
+                blobs.append(cPickle.dumps(config, cPickle.HIGHEST_PROTOCOL))
+            versions[version] = configs[config["filename"]]
+        files = {}
+        for filename, (mtime, size) in self._listConfigFiles().items():
+            files[filename] = (mtime, size, self._hashConfigFile(filename))
+
+        # the offsets depend on the size of the index, so we need to fix it up
+        # until it does not change anymore
+        offsets = []
+        headerLength = 0
+        while 1:
+            offsets = []
+            position = len(cacheMagic) + 4 + hashLength + headerLength
+            for blob in blobs:
+                offsets.append((position, len(blob), hashlib.sha1(blob).digest()))
+                position += len(blob)
+            index = {"files": files, "versions": dict([(version, offsets[i]) for version, i in versions.items()])}
+            header = cPickle.dumps(index, cPickle.HIGHEST_PROTOCOL)
+            if len(header) == headerLength:
+                break
+            headerLength = len(header)
+
+        # write to an other file first, so a reader never sees a half written cache
+        try:
+            tmpFile = self._cacheFile + ".tmp"
+            f = open(tmpFile, "wb")
+            f.write(cacheMagic + struct.pack("<I", len(header)) + hashlib.sha1(header).digest() + header + "".join(blobs))
+            f.close()
+            os.rename(tmpFile, self._cacheFile)
+        except (IOError, OSError), e:
+            print "Error: could not write the protocol versions cache %s (%s)" % (self._cacheFile, e)
+            return
+        self._cacheIndex = index
+    
     def parseAllConfigs(self):
         """ searches through the directory and adds eachs version config to the big config """
         result = {}
         for filename in os.listdir(self._versionsConfigDirectory):
             if os.path.splitext(filename)[1].lower() == ".ini":
-                versions, config = self.parseConfig(os.path.join(self._versionsConfigDirectory, filename))
+                versions, config = parseConfig(os.path.join(self._versionsConfigDirectory, filename))
                 for version in versions:
                     result[version] = config
         return result
-
-    def parseConfig(self, filename):
-        """ parses the config into our internal format, not much error handling is done
-            at this point as these files should be only created by "experts" ;-)
-        """
-        config = {}
-        
-        p = ConfigParser()
-        p.read(filename)
-        
-        # global section stuff
-        versions = p.get("Global", "versions").strip().split()
-        config["author"] = p.get("Global", "author")
-        config["comment"] = p.get("Global", "comment")
-        
-        # later this can be extended for multible replaces
-        tmp = p.get("Global", "globalReplaceString").strip().decode("string-escape").split()
-        if not tmp:
-            config["globalReplaceString"] = None
-        else:
-            config["globalReplaceString"] = tmp
-        
-        # now jump to the query specific settings
-        queries = []
-        for queryName in p.get("Global", "queries").strip().split():
-            query = {"name": queryName}
-            query["comment"] = p.get(queryName, "comment")
-            query["request"] = p.get(queryName, "request").decode("string-escape")
-            query["responseLength"] = p.getint(queryName, "responseLength")
-            
-            # now the value part in the correct order
-            tmp = p.items(queryName)
-            tmp.sort()
-            vs = []
-            for name, value in tmp:
-                if not name.startswith("value"):
-                    continue
-                v = value.strip().split()
-                if v[2].lower() == "fixedpoint":
-                    vs.append({"name": v[0], "position": int(v[1]), "type": "fixedPoint", "size": int(v[3]), "fixedDecimals": int(v[4])})
-                elif v[2].lower() == "datetime":
-                    vs.append({"name": v[0], "position": int(v[1]), "type": "DateTime", "size": int(v[3]), "separator": v[4]})
-            query["values"] = vs
-            queries.append(query)
-        config["queries"] = queries
-        return versions, config
         
 
 # Main program: only for testing
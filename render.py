@@ -18,11 +18,12 @@
 
 import time
 import os
+import sys
+import threading
+import multiprocessing
 
-from pyrrd.rrd import RRD, RRA, DS
-from pyrrd.graph import DEF, CDEF, VDEF
-from pyrrd.graph import LINE, AREA, GPRINT
-from pyrrd.graph import ColorAttributes, Graph
+import rrdBackend
+import rrdReader
 
 # some constants - don't change them
 hour = 60 * 60
@@ -60,11 +61,20 @@ times = {
                 }
         }
 
+# the sizes (width, height) in which every graph is painted
+sizes = {
+         "small": (400, 100),
+         "big": (800, 400)
+        }
+
 # define how our graphs should look like
 
+# minMax paints a band between the minimum and maximum behind the lines, which
+# shows the peaks the average hides on the long ranges
 graphsDefinition = {"enduser_temperatures": {
                         "title": "Enduser temperatures", 
                         "verticalLabel": '"degree celsius"', 
+                        "minMax": True,
                         "sources": {
                                     "flow_temp":{
                                             "title": "flow temperature", 
@@ -123,6 +133,7 @@ graphsDefinition = {"enduser_temperatures": {
                     "internaltemps": {
                         "title": 'heat pump internal temperatures', 
                         "verticalLabel": '"degree celsius"', 
+                        "minMax": True,
                         "sources": {
                                     "hot_gas_temp":{
                                             "title": "hot gas temperature", 
@@ -151,77 +162,170 @@ graphsDefinition = {"enduser_temperatures": {
 
 ########################### no changes beyond here required ##############################
 
+# the backends of a worker process, by name
+_workerBackends = {}
+
+def _initWorker(niceLevel):
+    os.nice(niceLevel)
+
+def _renderJob(backendName, outputFile, rrdFile, graphData, start, end, step, width, height, minMax):
+    """ paints a graph in a worker process """
+    if backendName not in _workerBackends:
+        _workerBackends[backendName] = rrdBackend.getBackend(backendName)
+    _workerBackends[backendName].graph(outputFile, rrdFile, graphData, start, end, step, width, height, minMax)
+
+
 class Render:
-    # our graph object
+    # the names of our graphs
     _graphs = None
     _filename = None
     _outputPath = None
+    _backend = None
+    _reader = None
+    # true if the database has MIN and MAX archives, None if not checked yet
+    _minMax = None
+    # (graph, time, size) -> (end time, minMax) of the last painting
+    _rendered = None
+    # the worker processes and the limits of a cycle
+    _workers = None
+    _niceLevel = None
+    _budget = None
+    _pool = None
+    _lock = None
+    # the (graph, time, size) which did not fit into the budget of the last cycle
+    _deferred = None
 
-    def __init__(self, filename="heatpumpMonitor.rrd", outputPath = "."):
+    def __init__(self, filename="heatpumpMonitor.rrd", outputPath = ".", backend=None, workers=0, niceLevel=0, budget=0):
+        """ with workers > 0 the graphs are painted by that many processes with the nice
+            level, with a budget no more graphs are started after that many seconds
+        """
         if not os.path.isfile(filename):
             raise IOError, "Error: RRD file missing"
         self._filename = filename    
         self._outputPath = outputPath
-        self._graphs = self._initialize()
-    
-    def _initialize(self):
-        """ set up erything we need """
-
-        # Let's configure some custom colors for the graph
-        ca = ColorAttributes()
-        ca.back = '#333333'
-        ca.canvas = '#333333'
-        ca.shadea = '#000000'
-        ca.shadeb = '#111111'
-        ca.mgrid = '#CCCCCC'
-        ca.axis = '#FFFFFF'
-        ca.frame = '#AAAAAA'
-        ca.font = '#FFFFFF'
-        ca.arrow = '#FFFFFF'
-
-        # Let's set up the objects that will be added to the graphs
-        result = []
-        for graphName, graphData in graphsDefinition.items():
-            tmp = []
-            for sourceName, sourceData in graphData["sources"].items():
-                tmp.append(DEF(rrdfile=self._filename, vname=sourceName, dsName=sourceName))
-                if sourceData["type"] == "line":
-                    tmp.append(LINE(value=sourceName, color=sourceData["color"], legend=sourceData["title"]))
-                elif sourceData["type"] == "area":
-                    tmp.append(AREA(value=sourceName, color=sourceData["color"], legend=sourceData["title"]))
-                
-            # Now that we've got everything set up, let's make a graph
-            g = Graph('dummy.png', vertical_label=graphData["verticalLabel"], color=ca)
-            g.data.extend(tmp)
-            g.title = '"%s"' % graphData["title"]
-            # create a new variable
-            g.filenameBase = graphName
-            result.append(g)
-        return result
+        self._backend = backend or rrdBackend.getBackend()
+        self._reader = rrdReader.RrdReader(filename)
+        self._graphs = graphsDefinition.keys()
+        self._rendered = {}
+        self._workers = workers
+        self._niceLevel = niceLevel
+        self._budget = budget
+        self._deferred = set()
+        self._lock = threading.Lock()
 
     def render(self):
-        """ does the actual painting """
+        """ does the actual painting, a graph is only painted again if the archive
+            it shows got a new row since the last time
+        """
         # Iterate through the different resoltions for which we want to 
         # generate graphs.
-        currentTime = int(time.time())
-        for timeName, timeData in times.items():
-            for g in self._graphs:
-                # common stuff first
-                g.start =  currentTime - timeData["time"]
-                g.end = currentTime
-                g.step  = timeData["step"]
-                
-                # First, the small graph
-                g.filename = os.path.join(self._outputPath,"%s_%s_small.png" % (g.filenameBase, timeName))
-                g.width = 400
-                g.height = 100
-                g.write(debug=False)
-                
-                # Then the big one
-                g.filename = os.path.join(self._outputPath,"%s_%s_big.png" % (g.filenameBase, timeName))
-                g.width = 800
-                g.height = 400
-                g.write()
+        startTime = time.time()
+        currentTime = int(startTime)
+        # databases created before the MIN and MAX archives existed don't have them
+        self._minMax = None
+        jobs = []
+        for timeName in times:
+            endTime = self.getEndTime(timeName, currentTime)
+            for graphName in self._graphs:
+                for sizeName in sizes:
+                    if not self._isUpToDate(graphName, timeName, sizeName, endTime):
+                        jobs.append((graphName, timeName, sizeName, endTime))
+        # the ones deferred last time first, then the short ranges as they change more often
+        jobs.sort(key=lambda job: (job[:3] not in self._deferred, times[job[1]]["time"]))
+        if self._workers:
+            self._renderParallel(jobs, startTime)
+        else:
+            deadline = startTime + self._budget
+            for i, (graphName, timeName, sizeName, endTime) in enumerate(jobs):
+                if self._budget and time.time() >= deadline:
+                    self._defer(jobs[i:])
+                    return
+                self.renderGraph(graphName, timeName, endTime, [sizeName])
+            self._deferred = set()
+
+    def _renderParallel(self, jobs, startTime):
+        """ gives the jobs to the worker processes, at most one per worker at a time """
+        if not self._pool:
+            self._pool = multiprocessing.Pool(self._workers, _initWorker, (self._niceLevel,))
+        minMax = self.hasMinMax()
+        running = []
+        error = None
+        while jobs or running:
+            while jobs and len(running) < self._workers:
+                if self._budget and time.time() >= startTime + self._budget:
+                    break
+                graphName, timeName, sizeName, endTime = job = jobs.pop(0)
+                timeData = times[timeName]
+                width, height = sizes[sizeName]
+                running.append((job, self._pool.apply_async(_renderJob,
+                                (self._backend.name, self._getFilename(graphName, timeName, sizeName), self._filename,
+                                 graphsDefinition[graphName], endTime - timeData["time"], endTime, timeData["step"],
+                                 width, height, minMax))))
+            if not running:
+                break
+            (graphName, timeName, sizeName, endTime), result = running.pop(0)
+            try:
+                result.get()
+                self._rendered[(graphName, timeName, sizeName)] = (endTime, minMax)
+            except Exception, e:
+                # the other graphs are painted anyway
+                error = e
+        self._defer(jobs)
+        if error:
+            raise error
+
+    def _defer(self, jobs):
+        self._deferred = set([job[:3] for job in jobs])
+        if jobs:
+            print "Error: render budget of %d seconds exceeded, %d graphs are painted in the next cycle" % (self._budget, len(jobs))
+            sys.stdout.flush()
+
+    def close(self):
+        """ stops the worker processes """
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def getEndTime(self, timeName, currentTime):
+        """ the graphs end with the newest row of the archive rrdtool uses for them,
+            so they stay the same till the next row is consolidated
+        """
+        timeData = times[timeName]
+        archiveStep, lastRow = self._reader.lastRow(currentTime - timeData["time"], timeData["step"])
+        return lastRow
+
+    def hasMinMax(self):
+        """ true if the database has MIN and MAX archives """
+        if self._minMax is None:
+            self._minMax = set(["MIN", "MAX"]) <= self._backend.consolidationFunctions(self._filename)
+        return self._minMax
+
+    def _getFilename(self, graphName, timeName, sizeName):
+        return os.path.join(self._outputPath,"%s_%s_%s.png" % (graphName, timeName, sizeName))
+
+    def _isUpToDate(self, graphName, timeName, sizeName, endTime):
+        """ true if painting it again would give the same picture """
+        return (self._rendered.get((graphName, timeName, sizeName)) == (endTime, self.hasMinMax()) and
+                os.path.isfile(self._getFilename(graphName, timeName, sizeName)))
+
+    def renderGraph(self, graphName, timeName, endTime, sizeNames=None):
+        """ paints one graph for one time range, default in all sizes """
+        minMax = self.hasMinMax()
+        for sizeName in sorted(sizeNames or sizes, reverse=True):
+            self.renderTo(self._getFilename(graphName, timeName, sizeName), graphName, timeName, sizeName, endTime)
+            self._rendered[(graphName, timeName, sizeName)] = (endTime, minMax)
+
+    def renderTo(self, filename, graphName, timeName, sizeName, endTime):
+        """ paints one graph into the file, the rrdtool bindings can only paint one at a time """
+        timeData = times[timeName]
+        width, height = sizes[sizeName]
+        self._lock.acquire()
+        try:
+            self._backend.graph(filename, self._filename, graphsDefinition[graphName],
+                                endTime - timeData["time"], endTime, timeData["step"], width, height, self.hasMinMax())
+        finally:
+            self._lock.release()
 
 
 
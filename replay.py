@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module decodes the frames recorded by frameCapture.py again and writes
+    the values into a new database. Use it if a value definition in a protocol
+    version file was wrong (e.g. position or fixedDecimals), so the history
+    can be rebuilt with the fixed definition. The values are written in large
+    batches and only one batch is kept in memory.
+
+    usage: replay.py [options] captureDirectory databaseFile
+"""
+
+import os
+import sys
+import time
+import optparse
+
+import frameCapture
+import protocolVersions
+
+# a new poll starts if there is such a gap between two frames
+maxPollGap = 30
+
+class Replay:
+    _captureDirectory = None
+    _config = None
+    _queries = None
+    frames = None
+    skipped = None
+
+    def __init__(self, captureDirectory, config):
+        self._captureDirectory = captureDirectory
+        self._config = config
+        self._queries = dict([(query["name"], query) for query in config["queries"]])
+        self.frames = 0
+        self.skipped = 0
+
+    def samples(self, start=None, end=None):
+        """ yields (timestamp, values) for every poll, the values are merged like
+            Protocol.query does it, so queries which are not done every poll keep
+            their last values
+        """
+        lastValues = {}
+        pollQueries = set()
+        pollTime = None
+        lastTime = None
+        for timestamp, queryName, requestId, flags, data in frameCapture.FrameCaptureReader(self._captureDirectory).records(start, end):
+            self.frames += 1
+            query = self._queries.get(queryName)
+            # data is checksum, response id and payload
+            if flags & frameCapture.flagInvalid or not query or len(data) - 2 != query["responseLength"]:
+                self.skipped += 1
+                continue
+
+            # a query we already have in this poll or a gap starts the next poll
+            if pollTime is not None and (queryName in pollQueries or timestamp - lastTime > maxPollGap):
+                yield pollTime, self._merge(lastValues)
+                pollQueries = set()
+                pollTime = None
+            if pollTime is None:
+                pollTime = timestamp
+            pollQueries.add(queryName)
+            lastTime = timestamp
+            lastValues[queryName] = query["decodePlan"].decode(data[2:])
+        if pollTime is not None:
+            yield pollTime, self._merge(lastValues)
+
+    def _merge(self, lastValues):
+        result = {}
+        for query in self._config["queries"]:
+            result.update(lastValues.get(query["name"], {}))
+        return result
+
+
+# Main program: parse command line and start processing
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] captureDirectory databaseFile")
+    parser.add_option("-d", "--protocol-versions", default="/usr/local/share/heatpumpMonitor/protocolVersions",
+                      help="directory with the protocol version files")
+    parser.add_option("-v", "--version", help="heat pump software version whose definition is used")
+    parser.add_option("-f", "--definition", help="protocol version file to use instead of the version")
+    parser.add_option("-s", "--start", type="float", help="first time (seconds since the epoch) to replay")
+    parser.add_option("-e", "--end", type="float", help="last time (seconds since the epoch) to replay")
+    parser.add_option("-b", "--batch-size", type="int", default=1000, help="samples written with one update")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("capture directory and database file are required")
+    if not options.version and not options.definition:
+        parser.error("either a version or a definition file is required")
+    captureDirectory, databaseFile = args
+    if os.path.exists(databaseFile):
+        parser.error("%s exists, the values are only written into a new database" % databaseFile)
+
+    # imported here, so the help works without the rrd libraries
+    import storage
+
+    if options.definition:
+        versions, config = protocolVersions.parseConfig(options.definition)
+    else:
+        config = protocolVersions.ProtocolVersions(options.protocol_versions).getConfig(options.version)
+    print "Using protocol definition from %s (%s)" % (config["author"], config["comment"])
+
+    r = Replay(captureDirectory, config)
+    s = None
+    batch = []
+    written = 0
+    lastTimestamp = 0
+    startTime = time.time()
+    for timestamp, values in r.samples(options.start, options.end):
+        # the database takes only one value per second
+        timestamp = int(timestamp)
+        if timestamp <= lastTimestamp:
+            continue
+        lastTimestamp = timestamp
+        if s is None:
+            s = storage.Storage(databaseFile, start=timestamp - 1)
+        batch.append((timestamp, values))
+        if len(batch) >= options.batch_size:
+            s.addBatch(batch)
+            written += len(batch)
+            batch = []
+            print "%d samples written, %d frames read, at %s" % (written, r.frames, time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)))
+            sys.stdout.flush()
+    if batch:
+        s.addBatch(batch)
+        written += len(batch)
+    print "Done: %d samples from %d frames (%d skipped) in %d seconds" % (written, r.frames, r.skipped, time.time() - startTime)
+
+if __name__ == '__main__':
+    main()
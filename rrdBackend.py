@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module hides how the round robin database is accessed from the
+    storage and render modules. The pyrrd backend starts an rrdtool process
+    for every update and graph, the rrdtool backend uses the python bindings
+    of rrdtool and does everything within our process, which saves a lot of
+    cpu on small embedded systems.
+"""
+
+import sys
+import subprocess
+
+# pyrrd is not needed if the python bindings of rrdtool are installed
+try:
+    from pyrrd.rrd import RRD, RRA, DS
+    from pyrrd.graph import DEF, CDEF, LINE, AREA
+    from pyrrd.graph import ColorAttributes, Graph
+    havePyrrd = True
+except ImportError:
+    havePyrrd = False
+
+# the python bindings of rrdtool are optional
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None
+
+# the colors of the graphs
+colors = {
+          "back": "#333333",
+          "canvas": "#333333",
+          "shadea": "#000000",
+          "shadeb": "#111111",
+          "mgrid": "#CCCCCC",
+          "axis": "#FFFFFF",
+          "frame": "#AAAAAA",
+          "font": "#FFFFFF",
+          "arrow": "#FFFFFF"
+         }
+
+def getBackend(name="pyrrd"):
+    """ returns the requested backend, if the rrdtool bindings are not
+        installed the pyrrd backend is used and the other way round
+    """
+    if name == "rrdtool":
+        if rrdtool:
+            return RrdtoolBackend()
+        print "Error: the rrdtool python bindings are not installed, using pyrrd"
+        sys.stdout.flush()
+    elif name != "pyrrd":
+        raise ValueError, "Error: unknown rrd backend %s" % name
+    if not havePyrrd:
+        if not rrdtool:
+            raise ImportError, "Error: neither pyrrd nor the rrdtool python bindings are installed"
+        print "Error: pyrrd is not installed, using the rrdtool python bindings"
+        sys.stdout.flush()
+        return RrdtoolBackend()
+    return PyrrdBackend()
+
+def _rrdtool(*args):
+    """ runs the rrdtool program like pyrrd does and returns its output """
+    p = subprocess.Popen(("rrdtool",) + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = p.communicate()
+    if p.returncode:
+        raise IOError, "Error: rrdtool %s failed: %s" % (args[0], error.strip())
+    return output
+
+def _graphBands(graphData, sourceData, minMax):
+    """ true if a min/max band is painted behind the line of the source """
+    return minMax and graphData.get("minMax") and sourceData["type"] == "line"
+
+
+class PyrrdBackend:
+    """ the backend which calls the rrdtool program via pyrrd """
+    name = "pyrrd"
+    _rrds = None
+
+    def __init__(self):
+        self._rrds = {}
+
+    def _getRRD(self, filename):
+        if filename not in self._rrds:
+            self._rrds[filename] = RRD(filename)
+        return self._rrds[filename]
+
+    def consolidationFunctions(self, filename):
+        """ returns the set of consolidation functions the archives of the database use """
+        result = set()
+        for line in _rrdtool("info", filename).splitlines():
+            key, sep, value = line.partition(" = ")
+            if key.startswith("rra[") and key.endswith("].cf"):
+                result.add(value.strip('"'))
+        return result
+
+    def create(self, filename, step, start, dataSources, archives, heartbeat):
+        """ creates the database, the archives are (cf, steps, rows) tuples """
+        dss = []
+        for source in dataSources:
+            dss.append(DS(dsName=source, dsType='GAUGE', heartbeat=heartbeat))
+        rras = []
+        for cf, steps, rows in archives:
+            rras.append(RRA(cf=cf, xff=0, steps=steps, rows=rows))
+        myRRD = RRD(filename, step=step, ds=dss, rra=rras, start=start)
+        myRRD.create(debug=False)
+        self._rrds[filename] = myRRD
+
+    def update(self, filename, samples):
+        """ writes a list of (timestamp, row) with one update """
+        myRRD = self._getRRD(filename)
+        for timestamp, row in samples:
+            myRRD.bufferValue(timestamp, *row)
+        myRRD.update(debug=False)
+
+    def graph(self, outputFile, rrdFile, graphData, start, end, step, width, height, minMax=False):
+        """ paints the graph defined like in render.graphsDefinition, with minMax the
+            graphs which want it get a band between the minimum and maximum of their lines
+        """
+        ca = ColorAttributes()
+        for name, color in colors.items():
+            setattr(ca, name, color)
+        g = Graph(outputFile, vertical_label=graphData["verticalLabel"], color=ca)
+        g.title = '"%s"' % graphData["title"]
+        g.start = start
+        g.end = end
+        g.step = step
+        g.width = width
+        g.height = height
+        # the bands are painted first, so the lines are above them
+        for sourceName, sourceData in graphData["sources"].items():
+            if _graphBands(graphData, sourceData, minMax):
+                g.data.append(DEF(rrdfile=rrdFile, vname=sourceName + "_min", dsName=sourceName, cf="MIN"))
+                g.data.append(DEF(rrdfile=rrdFile, vname=sourceName + "_max", dsName=sourceName, cf="MAX"))
+                g.data.append(CDEF(vname=sourceName + "_range", rpn="%s_max,%s_min,-" % (sourceName, sourceName)))
+                # an area without color is not painted, the range is stacked on it
+                g.data.append(AREA(value=sourceName + "_min"))
+                g.data.append(AREA(value=sourceName + "_range", color=sourceData["color"] + "40", stack=True))
+        for sourceName, sourceData in graphData["sources"].items():
+            g.data.append(DEF(rrdfile=rrdFile, vname=sourceName, dsName=sourceName))
+            if sourceData["type"] == "line":
+                g.data.append(LINE(value=sourceName, color=sourceData["color"], legend=sourceData["title"]))
+            elif sourceData["type"] == "area":
+                g.data.append(AREA(value=sourceName, color=sourceData["color"], legend=sourceData["title"]))
+        g.write(debug=False)
+
+
+class RrdtoolBackend:
+    """ the backend which uses the rrdtool python bindings, no process is started """
+    name = "rrdtool"
+
+    def create(self, filename, step, start, dataSources, archives, heartbeat):
+        """ creates the database, the archives are (cf, steps, rows) tuples """
+        args = [filename, "--step", str(step), "--start", str(start)]
+        for source in dataSources:
+            args.append("DS:%s:GAUGE:%d:U:U" % (source, heartbeat))
+        for cf, steps, rows in archives:
+            args.append("RRA:%s:0:%d:%d" % (cf, steps, rows))
+        rrdtool.create(*args)
+
+    def update(self, filename, samples):
+        """ writes a list of (timestamp, row) with one update """
+        args = [filename]
+        for timestamp, row in samples:
+            args.append(":".join([str(timestamp)] + [str(value) for value in row]))
+        rrdtool.update(*args)
+
+    def consolidationFunctions(self, filename):
+        """ returns the set of consolidation functions the archives of the database use """
+        result = set()
+        for key, value in rrdtool.info(filename).items():
+            if key.startswith("rra[") and key.endswith("].cf"):
+                result.add(value)
+        return result
+
+    def graph(self, outputFile, rrdFile, graphData, start, end, step, width, height, minMax=False):
+        """ paints the graph defined like in render.graphsDefinition, with minMax the
+            graphs which want it get a band between the minimum and maximum of their lines
+        """
+        args = [outputFile, "--start", str(start), "--end", str(end), "--step", str(step),
+                "--width", str(width), "--height", str(height),
+                # the definition has the quotes for the shell of pyrrd
+                "--title", graphData["title"], "--vertical-label", graphData["verticalLabel"].strip('"')]
+        for name, color in colors.items():
+            args.extend(["--color", "%s%s" % (name.upper(), color)])
+        # the bands are painted first, so the lines are above them
+        for sourceName, sourceData in graphData["sources"].items():
+            if _graphBands(graphData, sourceData, minMax):
+                args.append("DEF:%s_min=%s:%s:MIN" % (sourceName, rrdFile, sourceName))
+                args.append("DEF:%s_max=%s:%s:MAX" % (sourceName, rrdFile, sourceName))
+                args.append("CDEF:%s_range=%s_max,%s_min,-" % (sourceName, sourceName, sourceName))
+                # an area without color is not painted, the range is stacked on it
+                args.append("AREA:%s_min" % sourceName)
+                args.append("AREA:%s_range%s40::STACK" % (sourceName, sourceData["color"]))
+        for sourceName, sourceData in graphData["sources"].items():
+            args.append("DEF:%s=%s:%s:AVERAGE" % (sourceName, rrdFile, sourceName))
+            if sourceData["type"] == "line":
+                args.append("LINE1:%s%s:%s" % (sourceName, sourceData["color"], sourceData["title"]))
+            elif sourceData["type"] == "area":
+                args.append("AREA:%s%s:%s" % (sourceName, sourceData["color"], sourceData["title"]))
+        rrdtool.graph(*args)
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module reads the values out of a round robin database without
+    rrdtool. The file is memory mapped and its structures are read with the
+    layout rrdtool uses on this machine (native byte order and alignment).
+    A consolidated row is not changed anymore till the ring overwrites it, so
+    recently read windows are cached by their row positions and times.
+
+    usage: rrdReader.py databaseFile [start [end [resolution]]]
+"""
+
+import os
+import sys
+import time
+import mmap
+import array
+import struct
+import threading
+import collections
+
+# the structures of rrd_format.h
+statHead = struct.Struct("@4s5sdLLL10d")
+dsDef = struct.Struct("@20s20s10d")
+rraDef = struct.Struct("@20sLL10d")
+liveHead = struct.Struct("@ll")
+liveHeadOld = struct.Struct("@l") # before version 0003 there were no micro seconds
+pdpPrep = struct.Struct("@30s10d")
+cdpPrep = struct.Struct("@10d")
+rraPtr = struct.Struct("@L")
+value = struct.Struct("@d")
+
+# rrdtool writes this double into each file, so the layout can be checked
+floatCookie = 8.642135E130
+
+def _cString(s):
+    return s.split("\0", 1)[0]
+
+
+class RrdReader:
+    _filename = None
+    _cacheSize = None
+    _cache = None
+    _lock = None
+
+    def __init__(self, filename, cacheSize=64):
+        self._filename = filename
+        self._cacheSize = cacheSize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _readHeader(self, m):
+        """ returns (step, sources, archives, lastUpdate, offset of the first row), the
+            archives are (cf, rows, steps, current row) tuples
+        """
+        cookie, version, cookieValue, dsCount, rraCount, step = statHead.unpack_from(m, 0)[:6]
+        if cookie != "RRD\0" or cookieValue != floatCookie:
+            raise IOError, "Error: %s is not a round robin database of this machine" % self._filename
+        offset = statHead.size
+        sources = []
+        for i in xrange(dsCount):
+            sources.append(_cString(dsDef.unpack_from(m, offset)[0]))
+            offset += dsDef.size
+        archives = []
+        for i in xrange(rraCount):
+            cf, rows, steps = rraDef.unpack_from(m, offset)[:3]
+            archives.append([_cString(cf), rows, steps])
+            offset += rraDef.size
+        if _cString(version) >= "0003":
+            lastUpdate = liveHead.unpack_from(m, offset)[0]
+            offset += liveHead.size
+        else:
+            lastUpdate = liveHeadOld.unpack_from(m, offset)[0]
+            offset += liveHeadOld.size
+        offset += pdpPrep.size * dsCount + cdpPrep.size * dsCount * rraCount
+        for archive in archives:
+            archive.append(rraPtr.unpack_from(m, offset)[0])
+            offset += rraPtr.size
+        return step, sources, archives, lastUpdate, offset
+
+    def _selectArchive(self, step, archives, lastUpdate, start, resolution, cf):
+        """ returns the index of the archive which fits best like rrdtool does it:
+            the one with the resolution nearest to the wanted one, which has the
+            whole range. If none has it, the one which has the most of it.
+        """
+        full = []
+        partial = []
+        for i, (archiveCf, rows, steps, currentRow) in enumerate(archives):
+            if archiveCf != cf:
+                continue
+            archiveStep = step * steps
+            lastRow = lastUpdate - lastUpdate % archiveStep
+            firstRow = lastRow - (rows - 1) * archiveStep
+            # on a tie the finer one wins
+            if firstRow <= start:
+                full.append((abs(resolution - archiveStep), archiveStep, i))
+            else:
+                partial.append((firstRow, abs(resolution - archiveStep), i))
+        if full:
+            return min(full)[2]
+        if partial:
+            return min(partial)[2]
+        raise ValueError, "Error: %s has no %s archive" % (self._filename, cf)
+
+    def _map(self):
+        """ returns (inode, memory map) of the database """
+        f = open(self._filename, "rb")
+        try:
+            return os.fstat(f.fileno()).st_ino, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    def fetch(self, start, end, sources=None, resolution=60, cf="AVERAGE"):
+        """ returns (time of the first value, step, {source: array("d")}), the values
+            are NaN if they are unknown. The time of a value is the end of its interval.
+        """
+        inode, m = self._map()
+        try:
+            step, fileSources, archives, lastUpdate, rowsOffset = self._readHeader(m)
+            if sources is None:
+                sources = fileSources
+            columns = [fileSources.index(source) for source in sources]
+            index = self._selectArchive(step, archives, lastUpdate, start, resolution, cf)
+            for archiveCf, rows, steps, currentRow in archives[:index]:
+                rowsOffset += rows * len(fileSources) * value.size
+            archiveCf, rows, steps, currentRow = archives[index]
+            archiveStep = step * steps
+
+            # the wanted times, at least one value
+            first = (int(start) + archiveStep - 1) // archiveStep * archiveStep
+            last = max(int(end) // archiveStep * archiveStep, first)
+            count = (last - first) // archiveStep + 1
+            # the times the archive has
+            lastRow = lastUpdate - lastUpdate % archiveStep
+            firstRow = lastRow - (rows - 1) * archiveStep
+            readFirst = max(first, firstRow)
+            readLast = min(last, lastRow)
+
+            result = {}
+            for source in sources:
+                result[source] = array.array("d", [float("nan")]) * count
+            if readFirst > readLast:
+                return first, archiveStep, result
+
+            # the row of a time is counted back from the actual row
+            position = (currentRow - (lastRow - readFirst) // archiveStep) % rows
+            readCount = (readLast - readFirst) // archiveStep + 1
+            key = (inode, index, position, readFirst, readCount, tuple(columns))
+            self._lock.acquire()
+            try:
+                values = self._cache.pop(key, None)
+                if values is not None:
+                    # it is the newest one now
+                    self._cache[key] = values
+            finally:
+                self._lock.release()
+            if values is None:
+                values = self._readRows(m, rowsOffset, rows, len(fileSources), position, readCount, columns)
+                self._lock.acquire()
+                try:
+                    self._cache[key] = values
+                    while len(self._cache) > self._cacheSize:
+                        self._cache.popitem(last=False)
+                finally:
+                    self._lock.release()
+            skip = (readFirst - first) // archiveStep
+            for source, column in zip(sources, values):
+                result[source][skip:skip + readCount] = column
+            return first, archiveStep, result
+        finally:
+            m.close()
+
+    def _readRows(self, m, rowsOffset, rows, dsCount, position, count, columns):
+        """ returns an array for every column with count rows starting at position,
+            the rows wrap around at the end of the archive
+        """
+        rowSize = dsCount * value.size
+        data = array.array("d")
+        while count:
+            n = min(count, rows - position)
+            offset = rowsOffset + position * rowSize
+            data.fromstring(m[offset:offset + n * rowSize])
+            count -= n
+            position = 0
+        return [data[column::dsCount] for column in columns]
+
+    def lastUpdate(self):
+        """ returns the time of the last update """
+        inode, m = self._map()
+        try:
+            return self._readHeader(m)[3]
+        finally:
+            m.close()
+
+    def lastRow(self, start, resolution=60, cf="AVERAGE"):
+        """ returns (step, time of the newest row) of the archive fetch would use """
+        inode, m = self._map()
+        try:
+            step, sources, archives, lastUpdate, rowsOffset = self._readHeader(m)
+        finally:
+            m.close()
+        archiveStep = step * archives[self._selectArchive(step, archives, lastUpdate, start, resolution, cf)][2]
+        return archiveStep, lastUpdate - lastUpdate % archiveStep
+
+
+# Main program: prints the values of a database
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(2)
+    end = time.time()
+    start = end - 3600
+    resolution = 60
+    if len(sys.argv) > 2:
+        start = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        end = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        resolution = int(sys.argv[4])
+    first, step, result = RrdReader(sys.argv[1]).fetch(start, end, resolution=resolution)
+    sources = sorted(result)
+    print " ".join(["%-16s" % "time"] + ["%12s" % source[:12] for source in sources])
+    for i in xrange(len(result[sources[0]])):
+        print " ".join(["%-16s" % time.strftime("%Y-%m-%d %H:%M", time.localtime(first + i * step))] +
+                       ["%12.2f" % result[source][i] for source in sources])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module writes the values of the graphs as data series, so the browser
+    can paint the charts itself. There is a file for every range of render.times
+    (e.g. series_day.json) with one json document per line: the first one
+    describes the series and graphs, every other one is a point
+    [time, value, value, ...] of the archive the graphs of the range use. New
+    points are appended, the file is only written again if it has twice the
+    points of its range.
+"""
+
+import os
+import time
+
+import render
+
+def _number(value):
+    """ a short json number, NaN is null """
+    if value != value:
+        return "null"
+    return ("%.2f" % value).rstrip("0").rstrip(".")
+
+def _string(s):
+    return '"%s"' % s.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class SeriesExport:
+    _storage = None
+    _outputPath = None
+    _sources = None
+    # range name -> (step, time of the last point, number of points)
+    _state = None
+
+    def __init__(self, aStorage, outputPath="."):
+        self._storage = aStorage
+        self._outputPath = outputPath
+        sources = set()
+        for graphData in render.graphsDefinition.values():
+            sources.update(graphData["sources"])
+        self._sources = sorted(sources)
+        self._state = {}
+
+    def _getFilename(self, timeName):
+        return os.path.join(self._outputPath, "series_%s.json" % timeName)
+
+    def _header(self, timeName, step):
+        graphs = []
+        for graphName, graphData in sorted(render.graphsDefinition.items()):
+            sources = []
+            for sourceName, sourceData in sorted(graphData["sources"].items()):
+                sources.append('{"name": %s, "title": %s, "color": %s, "type": %s}' % (
+                               _string(sourceName), _string(sourceData["title"]), _string(sourceData["color"]),
+                               _string(sourceData["type"])))
+            graphs.append('{"name": %s, "title": %s, "verticalLabel": %s, "sources": [%s]}' % (
+                          _string(graphName), _string(graphData["title"]), _string(graphData["verticalLabel"].strip('"')),
+                          ", ".join(sources)))
+        return '{"range": %s, "time": %d, "step": %d, "sources": [%s], "graphs": [%s]}\n' % (
+               _string(timeName), render.times[timeName]["time"], step, ", ".join([_string(source) for source in self._sources]),
+               ", ".join(graphs))
+
+    def _readState(self, timeName, step):
+        """ returns (time of the last point, number of points) of an existing file
+            which was written with the same header, else None
+        """
+        filename = self._getFilename(timeName)
+        if not os.path.isfile(filename):
+            return None
+        f = open(filename, "rb")
+        try:
+            if f.readline() != self._header(timeName, step):
+                return None
+            lastTime = 0
+            count = 0
+            for line in f:
+                # a line without newline was not written completely
+                if not line.endswith("\n"):
+                    return None
+                lastTime = int(line[1:line.index(",")])
+                count += 1
+            return lastTime, count
+        finally:
+            f.close()
+
+    def update(self):
+        """ appends the points which are new since the last update """
+        currentTime = int(time.time())
+        for timeName, timeData in render.times.items():
+            # the whole range is fetched, so the archive is the same as the graphs use
+            first, step, columns = self._storage.fetch(currentTime - timeData["time"], currentTime,
+                                                       self._sources, timeData["step"])
+            state = self._state.get(timeName)
+            if not state or state[0] != step:
+                state = (step,) + (self._readState(timeName, step) or (None, 0))
+            step, lastTime, count = state
+
+            lines = []
+            for i in xrange(len(columns[self._sources[0]])):
+                timestamp = first + i * step
+                values = [columns[source][i] for source in self._sources]
+                # the rows which are not consolidated yet and gaps are skipped
+                if (lastTime is not None and timestamp <= lastTime) or not [value for value in values if value == value]:
+                    continue
+                lines.append("[%d,%s]\n" % (timestamp, ",".join([_number(value) for value in values])))
+                lastTime = timestamp
+
+            filename = self._getFilename(timeName)
+            if state[1] is None or count + len(lines) > 2 * timeData["time"] / step:
+                # the file is new or too long, it gets only the points of the range
+                if state[1] is not None:
+                    lines = self._readPoints(filename, currentTime - timeData["time"]) + lines
+                f = open(filename + ".tmp", "wb")
+                f.write(self._header(timeName, step))
+                f.writelines(lines)
+                f.close()
+                os.rename(filename + ".tmp", filename)
+                count = len(lines)
+            elif lines:
+                f = open(filename, "ab")
+                f.writelines(lines)
+                f.close()
+                count += len(lines)
+            self._state[timeName] = (step, lastTime, count)
+
+    def _readPoints(self, filename, start):
+        """ returns the lines of the points which are not older than start """
+        f = open(filename, "rb")
+        try:
+            f.readline()
+            return [line for line in f if int(line[1:line.index(",")]) >= start]
+        finally:
+            f.close()
+
+
+# Main program: writes the series of a database
+def main():
+    import sys
+    import storage
+    if len(sys.argv) < 2:
+        print "usage: seriesExport.py databaseFile [outputPath]"
+        sys.exit(2)
+    outputPath = "."
+    if len(sys.argv) > 2:
+        outputPath = sys.argv[2]
+    SeriesExport(storage.Storage(sys.argv[1]), outputPath).update()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module simulates a LWZ heat pump on a pseudo terminal. It speaks the
+    serial protocol of protocol.py and generates the responses from a protocol
+    version ini file, so the protocol module can be tested and benchmarked
+    without a real heat pump. Latency, jitter, dropped bytes and checksum errors
+    can be configured to see how the protocol module handles a bad connection.
+
+    usage: simulator.py [options] protocolVersionFile
+"""
+
+import os
+import sys
+import tty
+import time
+import math
+import random
+import select
+import struct
+import threading
+import optparse
+
+import protocol
+import protocolVersions
+from protocol import STARTCOMMUNICATION, ESCAPE, BEGIN, END, GETVERSION
+
+class Simulator(threading.Thread):
+    # the pseudo terminal
+    _master = None
+    _slave = None
+
+    # the simulated heat pump software version and its protocol definition
+    _version = None
+    _config = None
+
+    # the bad connection settings
+    _byteTime = None
+    _jitter = None
+    _dropRate = None
+    _checksumErrorRate = None
+
+    # the response which is send if the heat pump is asked for the data
+    _response = None
+    _running = None
+    requests = None
+
+    def __init__(self, filename, baudrate=57600, jitter=0.0, dropRate=0.0, checksumErrorRate=0.0, seed=None):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        versions, self._config = protocolVersions.parseConfig(filename)
+        self._version = versions[0]
+        # 10 bits on the line per byte (start, 8 data and stop bit)
+        if baudrate:
+            self._byteTime = 10.0 / baudrate
+        else:
+            self._byteTime = 0.0
+        self._jitter = jitter
+        self._dropRate = dropRate
+        self._checksumErrorRate = checksumErrorRate
+        self._random = random.Random(seed)
+        self._running = True
+        self.requests = 0
+
+        self._master, self._slave = os.openpty()
+        # we don't want any translation of the bytes
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+
+    def getDevice(self):
+        """ returns the device name protocol.Protocol needs to open """
+        return os.ttyname(self._slave)
+
+    def stop(self):
+        self._running = False
+        self.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    ## ###############################  internal methods  ################################################
+
+    def _payload(self, query):
+        """ generates a response for the query with values which change a little
+            every time, every value gets written to its configured position
+        """
+        payload = bytearray(query["responseLength"])
+        phase = time.time() / 600.0
+        for i, entry in enumerate(query["values"]):
+            if entry["type"] == "fixedPoint":
+                # something which looks like a temperature
+                value = 20.0 + 15.0 * math.sin(phase + i) + self._random.uniform(-0.5, 0.5)
+                value = int(round(value * 10**entry["fixedDecimals"]))
+                f = {1: ">b", 2: ">h"}[entry["size"]]
+                if entry["size"] == 1:
+                    value = max(-128, min(127, value))
+            else:
+                # time or date, e.g. 12:34 or 24.12
+                value = self._random.randint(1, 28) * 100 + self._random.randint(1, 12)
+                f = "<H"
+            payload[entry["position"]:entry["position"] + entry["size"]] = struct.pack(f, value)
+        return str(payload)
+
+    def _frame(self, request, payload):
+        """ builds the response frame like the heat pump does """
+        s = protocol.addChecksum(request + payload)
+        if self._random.random() < self._checksumErrorRate:
+            s = chr((ord(s[0]) + 1) & 0xFF) + s[1:]
+        # this is the weird thing some firmware versions do
+        if self._config["globalReplaceString"]:
+            s = s.replace(self._config["globalReplaceString"][1], self._config["globalReplaceString"][0])
+        return BEGIN + s.replace(ESCAPE, ESCAPE + ESCAPE) + ESCAPE + END
+
+    def _send(self, s):
+        """ writes the string with the configured line speed and errors """
+        delay = len(s) * self._byteTime
+        if self._jitter:
+            delay += self._random.uniform(0, self._jitter)
+        if delay:
+            time.sleep(delay)
+        if self._dropRate:
+            s = "".join([c for c in s if self._random.random() >= self._dropRate])
+        os.write(self._master, s)
+
+    def _handle(self, buffer):
+        """ handles the requests in the buffer and returns what is left over """
+        while buffer:
+            if self._response is not None:
+                # the host tells us with an ESCAPE that it is ready to receive
+                if buffer[0] == ESCAPE and buffer[:2] != ESCAPE + STARTCOMMUNICATION:
+                    self._send(self._response)
+                    self._response = None
+                    buffer = buffer[1:]
+                    continue
+                self._response = None
+            if buffer[0] == STARTCOMMUNICATION:
+                # the "ping"
+                self._send(ESCAPE)
+                buffer = buffer[1:]
+            elif buffer[:2] == ESCAPE + STARTCOMMUNICATION:
+                # the host wants to talk again
+                self._send(ESCAPE)
+                buffer = buffer[2:]
+            elif buffer[:2] == BEGIN:
+                end = buffer.find(ESCAPE + END)
+                if end == -1:
+                    break # wait for the rest
+                request = buffer[2:end]
+                buffer = buffer[end + 2:]
+                if len(request) != 2 or not protocol.verifyChecksum(request):
+                    continue # the heat pump does not answer such a request
+                self.requests += 1
+                if request[1] == GETVERSION:
+                    version = int(round(float(self._version) * 100))
+                    self._response = self._frame(request[1], struct.pack(">h", version))
+                else:
+                    for query in self._config["queries"]:
+                        if query["request"] == request[1]:
+                            self._response = self._frame(request[1], self._payload(query))
+                            break
+                    else:
+                        continue
+                self._send(ESCAPE + STARTCOMMUNICATION)
+            else:
+                # something we do not understand
+                buffer = buffer[1:]
+        return buffer
+
+    def run(self):
+        buffer = ""
+        while self._running:
+            if not select.select([self._master], [], [], 0.1)[0]:
+                continue
+            buffer = self._handle(buffer + os.read(self._master, 1024))
+
+
+# Main program: parse command line and start processing
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] protocolVersionFile")
+    parser.add_option("-b", "--baudrate", type="int", default=57600, help="simulated line speed, 0 for no delay")
+    parser.add_option("-j", "--jitter", type="float", default=0.0, help="maximal additional delay of a response in seconds")
+    parser.add_option("-d", "--drop-rate", type="float", default=0.0, help="probability that a byte gets lost")
+    parser.add_option("-c", "--checksum-error-rate", type="float", default=0.0, help="probability of a wrong checksum")
+    parser.add_option("-t", "--test", action="store_true", help="query the simulator with protocol.py and exit")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("the protocol version file is missing")
+
+    s = Simulator(args[0], options.baudrate, options.jitter, options.drop_rate, options.checksum_error_rate)
+    s.start()
+    print "Simulating version %s on %s" % (s._version, s.getDevice())
+    sys.stdout.flush()
+    if options.test:
+        p = protocol.Protocol(s.getDevice(), os.path.dirname(args[0]) or ".", persistentConnection=True)
+        startTime = time.time()
+        for i in xrange(10):
+            print p.query()
+        print "10 polls took %.2f seconds" % (time.time() - startTime)
+        p.close()
+        s.stop()
+        return
+    try:
+        while 1:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        s.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module does the work with the values from the heat pump (storing,
+    rendering, checking, ...) in a seperate thread. This way the polling of
+    the heat pump does not need to wait till e.g. the rendering is done and
+    the next query runs while the values of the last one are processed.
+"""
+
+import sys
+import threading
+import Queue
+
+class SinkWorker(threading.Thread):
+    _queue = None
+    _errorHandler = None
+
+    def __init__(self, errorHandler, maxQueued=60):
+        threading.Thread.__init__(self)
+        # we don't want to block the exit of the program
+        self.setDaemon(True)
+        self._queue = Queue.Queue(maxQueued)
+        self._errorHandler = errorHandler
+
+    def submit(self, function, *args):
+        """ queues the function call, the calls are done in the order they got
+            submitted. Only blocks if the worker is far behind.
+        """
+        if self._queue.full():
+            print "Error: The processing of the values is too slow, the polling needs to wait"
+            sys.stdout.flush()
+        self._queue.put((function, args))
+
+    def stop(self):
+        """ finishes all queued work and stops the thread """
+        self._queue.put(None)
+        self.join()
+
+    def run(self):
+        while 1:
+            job = self._queue.get()
+            if job is None:
+                break
+            function, args = job
+            try:
+                function(*args)
+            except Exception, e:
+                # one failed sink must not stop the processing of the next values
+                self._errorHandler(e)
+
+
+# Main program: parse command line and start processing
+def main():
+    def failing():
+        raise ValueError, "test error"
+    def errorHandler(e):
+        print "got error:", e
+    w = SinkWorker(errorHandler)
+    w.start()
+    w.submit(failing)
+    w.submit(sys.stdout.write, "processed\n")
+    w.stop()
+    print "ended"
+
+if __name__ == '__main__':
+    main()
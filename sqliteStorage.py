@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module stores every value the heat pump returns in a SQLite database,
+    not only the ones in storage.dataSources. The values are never consolidated,
+    a table row holds one value of one source at one time and the index on
+    (source, timestamp) answers range queries without scanning the table.
+"""
+
+import time
+import sqlite3
+
+schema = """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS samples (
+    timestamp INTEGER NOT NULL,
+    source INTEGER NOT NULL REFERENCES sources(id),
+    value,
+    PRIMARY KEY (source, timestamp)
+);
+CREATE INDEX IF NOT EXISTS samples_timestamp ON samples (timestamp);
+"""
+
+class SqliteStorage:
+    _connection = None
+    _sources = None
+
+    def __init__(self, filename="heatpumpMonitor.sqlite"):
+        """ the values are written at once, storageWriter buffers them """
+        # the sink worker thread uses it, but it is created in an other one
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        # with the write ahead log readers don't block the writer and the other way round
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(schema)
+        self._sources = dict([(name, sourceId) for sourceId, name in self._connection.execute("SELECT id, name FROM sources")])
+
+    def _sourceId(self, name):
+        """ returns the id of the source, new sources are added """
+        if name not in self._sources:
+            cursor = self._connection.execute("INSERT INTO sources (name) VALUES (?)", (name,))
+            self._sources[name] = cursor.lastrowid
+        return self._sources[name]
+
+    def add(self, aDict, timestamp=None):
+        """ adds all provided values with the current datetime """
+        if timestamp is None:
+            timestamp = time.time()
+        self.addBatch([(timestamp, aDict)])
+
+    def addBatch(self, samples):
+        """ adds a list of (timestamp, dict) in one transaction, if it fails nothing is written """
+        try:
+            # the connection commits on success and rolls back on an error
+            with self._connection:
+                rows = []
+                for timestamp, aDict in samples:
+                    for name, value in aDict.items():
+                        rows.append((int(timestamp), self._sourceId(name), value))
+                # a second value for the same time replaces the first one
+                self._connection.executemany("INSERT OR REPLACE INTO samples (timestamp, source, value) VALUES (?, ?, ?)", rows)
+        except:
+            # the new sources got rolled back too
+            self._sources = dict([(name, sourceId) for sourceId, name in self._connection.execute("SELECT id, name FROM sources")])
+            raise
+
+    def getSources(self):
+        """ returns the names of all sources which have been stored so far """
+        return sorted(self._sources)
+
+    def fetch(self, source, start, end=None):
+        """ returns a list of (timestamp, value) of the source between start and end """
+        if end is None:
+            end = int(time.time())
+        if source not in self._sources:
+            return []
+        return self._connection.execute("SELECT timestamp, value FROM samples WHERE source = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+                                        (self._sources[source], int(start), int(end))).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+
+# Main program: parse command line and start processing
+def main():
+    aS = SqliteStorage(":memory:")
+    aS.add({"flow_temp": 25.8, "fault01time": "12:34", "booster_dhw": 12})
+    print aS.getSources()
+    print aS.fetch("fault01time", time.time() - 60)
+
+
+if __name__ == '__main__':
+    main()
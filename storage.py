@@ -19,9 +19,33 @@
 
 import time
 import os
-from pyrrd.rrd import RRD, RRA, DS
+import rrdBackend
+import rrdReader
 
 step = 60
+# after this many seconds without a value it is unknown
+heartbeat = 900
+
+# how the rrd archives the data: (consolidation function, steps, rows)
+# MIN and MAX keep the peaks which the average of a long range hides
+archives = (
+            # 1 days-worth of one-minute samples --> 60/1 * 24
+            ("AVERAGE", 1, 1440),
+            ("MIN", 1, 1440),
+            ("MAX", 1, 1440),
+            # 7 days-worth of five-minute samples --> 60/5 * 24 * 7
+            ("AVERAGE", 5, 2016),
+            ("MIN", 5, 2016),
+            ("MAX", 5, 2016),
+            # 30 days-worth of one hour samples --> 60/60 * 24 * 30
+            ("AVERAGE", 60, 720),
+            ("MIN", 60, 720),
+            ("MAX", 60, 720),
+            # 1 year-worth of half day samples --> 60/60 * 24/12 * 365
+            ("AVERAGE", 720, 730),
+            ("MIN", 720, 730),
+            ("MAX", 720, 730)
+           )
 
 # rrd allows only up to 19 chars
 dataSources = ( #1234567890123456789
@@ -46,48 +70,87 @@ dataSources = ( #1234567890123456789
 
 
 class Storage:
-    # our storage object
-    _rrd = None
-
-    def __init__(self, filename="heatpumpMonitor.rrd"):
+    # our database and how we access it
+    _filename = None
+    _backend = None
+    _reader = None
+    _lastTimestamp = None
+
+    def __init__(self, filename="heatpumpMonitor.rrd", start=None, backend=None):
+        """ the values are written at once, storageWriter buffers them """
+        self._filename = filename
+        self._backend = backend or rrdBackend.getBackend()
+        self._reader = rrdReader.RrdReader(filename)
+        self._lastTimestamp = 0
         if not os.path.isfile(filename):
-            self._rrd = self._createRRD(filename)
+            self._createRRD(filename, start)
         else:
-            self._rrd = RRD(filename)
-
-    def _createRRD(self, filename):
-        """ create an rrd file which fits our requirements """
-
-        # Let's setup some data sources for our RRD
-        dss = []
-        for source in dataSources:
-            dss.append(DS(dsName=source, dsType='GAUGE', heartbeat=900))
-
-        # An now let's setup how our RRD will archive the data
-        rras = []
-        # 1 days-worth of one-minute samples --> 60/1 * 24
-        rra1 = RRA(cf='AVERAGE', xff=0, steps=1, rows=1440) 
-        # 7 days-worth of five-minute samples --> 60/5 * 24 * 7
-        rra2 = RRA(cf='AVERAGE', xff=0, steps=5, rows=2016)
-        # 30 days-worth of one hour samples --> 60/60 * 24 * 30
-        rra3 = RRA(cf='AVERAGE', xff=0, steps=60, rows=720)
-        # 1 year-worth of half day samples --> 60/60 * 24/12 * 365
-        rra4 = RRA(cf='AVERAGE', xff=0, steps=720, rows=730)
-        rras.extend([rra1, rra2, rra3, rra4])
-
-        # With those setup, we can now created the RRD
-        myRRD = RRD(filename, step=step, ds=dss, rra=rras, start=int(time.time()))
-        myRRD.create(debug=False)
-        return myRRD
-
-    def add(self, aDict):
-        """ adds the provided values to the rrd database with the current datetime """
-        # we need to put the dict an correct line
+            # values which are older are refused by rrdtool
+            self._lastTimestamp = self._reader.lastUpdate()
+
+    def _createRRD(self, filename, start=None):
+        """ create an rrd file which fits our requirements, the first value
+            needs to be newer than start (default now)
+        """
+        if start is None:
+            start = int(time.time())
+        self._backend.create(filename, step, start, dataSources, archives, heartbeat)
+
+    def _row(self, aDict):
+        """ we need to put the dict an correct line """
         tmp = []
         for source in dataSources:
             tmp.append(aDict.get(source) or "U")
-        self._rrd.bufferValue(int(time.time()), *tmp)
-        self._rrd.update(debug=False)
+        return tmp
+
+    def add(self, aDict, timestamp=None):
+        """ adds the provided values to the rrd database with the current datetime """
+        if timestamp is None:
+            timestamp = time.time()
+        self.addBatch([(timestamp, aDict)])
+
+    def addBatch(self, samples):
+        """ adds a list of (timestamp, dict) with one update, the timestamps
+            need to be increasing. If the update fails nothing is written.
+        """
+        rows = []
+        lastTimestamp = self._lastTimestamp
+        for timestamp, aDict in samples:
+            timestamp = int(timestamp)
+            # rrdtool refuses the whole update if a timestamp is not newer than the last one
+            if timestamp <= lastTimestamp:
+                print "Error: values for %d dropped, the database has already values for this time" % timestamp
+                continue
+            lastTimestamp = timestamp
+            rows.append((timestamp, self._row(aDict)))
+        if rows:
+            self._backend.update(self._filename, rows)
+            self._lastTimestamp = lastTimestamp
+
+    def fetch(self, start, end=None, sources=dataSources, resolution=step, cf="AVERAGE"):
+        """ returns (time of the first value, step, {source: array("d")}) from the archive
+            with the consolidation function which fits the range and resolution best. Unknown
+            values are NaN.
+        """
+        if end is None:
+            end = int(time.time())
+        return self._reader.fetch(start, end, sources, resolution, cf)
+
+    def getPeaks(self, start, end=None, sources=dataSources):
+        """ returns a dict with (minimum, maximum) of the sources between start and end,
+            the MIN and MAX archives are read, so a long range needs only their rows.
+            Sources without a known value in the range are missing. Databases without
+            these archives raise a ValueError, migrate.py adds them.
+        """
+        result = {}
+        for cf, function in (("MIN", min), ("MAX", max)):
+            first, archiveStep, columns = self.fetch(start, end, sources, cf=cf)
+            for source in sources:
+                # NaN is not equal to itself
+                values = [value for value in columns[source] if value == value]
+                if values:
+                    result.setdefault(source, []).append(function(values))
+        return dict([(source, tuple(peaks)) for source, peaks in result.items()])
 
 
 # Main program: parse command line and start processing
@@ -100,7 +163,6 @@ def main():
            'flow temperature HC2': -60.0, 'expelled air speed set': 0.0, 'ventilator speed actual': 28,
            'softwareVersion': 4.3799999999999999, 'dew point temperature': 0.0, 'outside temperature': 5.0999999999999996}
     aS.add(tmp)
-    print aS._rrd.info()
 
     
 if __name__ == '__main__':
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#***************************************************************************
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation; either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""
+    This module writes the values into the storages (rrd, SQLite, archive) in
+    a seperate thread, so a slow or hanging disk does not delay anything else.
+    Every sample is appended to a write ahead file before it is queued and the
+    file is emptied after all storages got it. If a storage fails, the writer
+    keeps the samples it did not get and gives them to it with the next ones.
+    After a crash the samples in the file are written at the next start.
+"""
+
+import os
+import sys
+import time
+import struct
+import threading
+import Queue
+import cPickle
+
+# the length of each record in the write ahead file
+recordLength = struct.Struct("<I")
+
+def readWriteAheadFile(filename):
+    """ returns the (timestamp, values) in the file, a half written record at the end is ignored """
+    result = []
+    if not os.path.isfile(filename):
+        return result
+    f = open(filename, "rb")
+    try:
+        while 1:
+            s = f.read(recordLength.size)
+            if len(s) < recordLength.size:
+                break
+            length, = recordLength.unpack(s)
+            s = f.read(length)
+            if len(s) < length:
+                break
+            result.append(cPickle.loads(s))
+    finally:
+        f.close()
+    return result
+
+
+class StorageWriter(threading.Thread):
+    _stores = None
+    _writeAheadFile = None
+    _file = None
+    # add and the thread use the file, the lock keeps it and the queue in step
+    _fileLock = None
+    _bufferSize = None
+    _flushInterval = None
+    _errorHandler = None
+    _queue = None
+    # the samples which are not given to the storages yet
+    _batch = None
+    # for every storage the samples it did not get because it failed
+    _pending = None
+
+    def __init__(self, stores, writeAheadFile, errorHandler, bufferSize=1, flushInterval=0, maxQueued=1440):
+        """ the stores need addBatch like storage.Storage, they write what they
+            get at once and the buffering is done here. With a
+            bufferSize > 1 the values are written if that many are buffered or
+            the oldest buffered one is flushInterval seconds old
+        """
+        threading.Thread.__init__(self)
+        # we don't want to block the exit of the program
+        self.setDaemon(True)
+        self._stores = stores
+        self._writeAheadFile = writeAheadFile
+        self._errorHandler = errorHandler
+        self._bufferSize = bufferSize
+        self._flushInterval = flushInterval
+        self._queue = Queue.Queue(maxQueued)
+        # the samples of the last run which did not reach the storages
+        self._batch = readWriteAheadFile(writeAheadFile)
+        if self._batch:
+            print "Writing %d samples from %s" % (len(self._batch), writeAheadFile)
+            sys.stdout.flush()
+        self._pending = [[] for store in stores]
+        self._file = open(writeAheadFile, "ab")
+        self._fileLock = threading.Lock()
+
+    def add(self, aDict, timestamp=None):
+        """ appends the values to the write ahead file and queues them, this does
+            not wait for the storages and never raises. If they hang for so long
+            that the queue is full the values are dropped. If the write ahead file
+            cannot be written the values are queued anyway, only a crash loses them
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        s = cPickle.dumps((timestamp, aDict), cPickle.HIGHEST_PROTOCOL)
+        self._fileLock.acquire()
+        try:
+            position = None
+            try:
+                self._file.seek(0, 2)
+                position = self._file.tell()
+                # no fsync, we just want the samples to be there if the program crashes
+                self._file.write(recordLength.pack(len(s)) + s)
+                self._file.flush()
+            except (IOError, OSError), e:
+                print "Error: values for %d not written to %s, they are kept in memory only" % (timestamp, self._writeAheadFile)
+                self._errorHandler(e)
+                self._cutFile(position)
+                position = None
+            try:
+                self._queue.put_nowait((timestamp, aDict, None))
+            except Queue.Full:
+                self._cutFile(position)
+                print "Error: values for %d dropped, the storages are too slow" % timestamp
+                sys.stdout.flush()
+        finally:
+            self._fileLock.release()
+
+    def _cutFile(self, position):
+        """ removes a dropped or half written record at the end of the file """
+        if position is None:
+            return
+        try:
+            self._file.truncate(position)
+        except (IOError, OSError), e:
+            self._errorHandler(e)
+
+    def flush(self, timeout=60):
+        """ writes everything which is queued and buffered, returns when it is done
+            or after timeout seconds if the storages hang. Returns whether it is done
+        """
+        done = threading.Event()
+        self._queue.put((None, None, done))
+        if not done.wait(timeout):
+            print "Error: the storages did not write the values within %d seconds" % timeout
+            sys.stdout.flush()
+            return False
+        return True
+
+    def stop(self, timeout=60):
+        """ writes everything and stops the thread, but does not wait longer than
+            timeout seconds for hanging storages
+        """
+        self._queue.put(None)
+        self.join(timeout)
+
+    def run(self):
+        if self._batch:
+            self._write()
+        while 1:
+            job = self._queue.get()
+            if job is None:
+                self._write()
+                self._file.close()
+                break
+            timestamp, aDict, done = job
+            try:
+                if not done:
+                    self._batch.append((timestamp, aDict))
+                if done or len(self._batch) >= self._bufferSize or \
+                   (self._flushInterval and timestamp - self._batch[0][0] >= self._flushInterval):
+                    self._write()
+            except Exception, e:
+                # the thread must not die, flush and stop would wait for it
+                self._errorHandler(e)
+            if done:
+                done.set()
+
+    def _write(self):
+        """ gives the batch to every storage, a failed storage gets the values
+            again with the next batch
+        """
+        batch = self._batch
+        self._batch = []
+        for store, pending in zip(self._stores, self._pending):
+            pending.extend(batch)
+            if not pending:
+                continue
+            try:
+                store.addBatch(pending)
+                del pending[:]
+            except Exception, e:
+                self._errorHandler(e)
+        if [pending for pending in self._pending if pending]:
+            return
+        self._fileLock.acquire()
+        try:
+            # every storage has the values, but the queued ones are in the file too
+            if self._queue.empty():
+                self._file.seek(0)
+                self._file.truncate()
+        except (IOError, OSError), e:
+            # it is tried again with the next write, till then the values are written twice after a crash
+            self._errorHandler(e)
+        finally:
+            self._fileLock.release()
+
+
+# Main program: parse command line and start processing
+def main():
+    class PrintStore:
+        def addBatch(self, samples):
+            print "written:", samples
+    def errorHandler(e):
+        print "got error:", e
+    w = StorageWriter([PrintStore()], "test.wal", errorHandler, bufferSize=2)
+    w.start()
+    w.add({"flow_temp": 25.8}, 1)
+    w.add({"flow_temp": 25.9}, 2)
+    w.add({"flow_temp": 26.0}, 3)
+    w.flush()
+    w.stop()
+    os.remove("test.wal")
+
+if __name__ == '__main__':
+    main()